@@ -0,0 +1,85 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# SEASON ANALYTICS
+# ────────────────────────────────────────────────────────────────────────────────
+# Reads the archived nights (see archive.py) once into a long `appearances` frame, one
+# row per player per game with their partner, opponents and result. Every season view
+# is then a vectorised group-by over that frame, so the Season tab stays interactive
+# over tens of thousands of games. Doubles only, like the ratings and stats.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import archive
+
+GAME_COLUMNS = ['session_path', 'team1_pids', 'team2_pids', 'team1_score', 'team2_score', 'winner', 'date']
+
+
+class Season:
+    def __init__(self, dates, team1, team2, team1_scores, team2_scores, winners):
+        # dates: (N,) club-local game dates, team1/team2: (N, 2) pids, scores: (N,), winners: "Team 1"/"Team 2"/other
+        outcome = np.where(winners == "Team 1", 1.0, np.where(winners == "Team 2", 0.0, 0.5))
+        # The four seats of every game: the player, their partner, the other team and how it went for them
+        players, partners = [team1[:, 0], team1[:, 1], team2[:, 0], team2[:, 1]], [team1[:, 1], team1[:, 0], team2[:, 1], team2[:, 0]]
+        others, results = [team2, team2, team1, team1], [outcome, outcome, 1.0 - outcome, 1.0 - outcome]
+        scored, conceded = [team1_scores, team1_scores, team2_scores, team2_scores], [team2_scores, team2_scores, team1_scores, team1_scores]
+        self.appearances = pd.DataFrame({
+            'game': np.tile(np.arange(len(dates)), 4), 'date': pd.to_datetime(np.tile(dates, 4)),
+            'player': np.concatenate(players), 'partner': np.concatenate(partners),
+            'opponent_a': np.concatenate([o[:, 0] for o in others]), 'opponent_b': np.concatenate([o[:, 1] for o in others]),
+            'result': np.concatenate(results),
+            'points_for': np.concatenate(scored).astype(float), 'points_against': np.concatenate(conceded).astype(float),
+        })
+        self.games = len(dates)
+        self.first, self.last = (self.appearances['date'].min(), self.appearances['date'].max()) if self.games else (None, None)
+
+    @classmethod
+    def load(cls, root, session_prefix=None):
+        # All archived doubles games, optionally only sessions under `session_prefix` (a club)
+        import pyarrow.compute as pc
+        table = archive.load(root, 'games', columns=GAME_COLUMNS)
+        keep = pc.and_(pc.equal(pc.list_value_length(table['team1_pids']), 2), pc.equal(pc.list_value_length(table['team2_pids']), 2))
+        if session_prefix: keep = pc.and_(keep, pc.starts_with(table['session_path'], session_prefix))
+        table = table.filter(keep)
+        pairs = lambda column: table[column].combine_chunks().flatten().to_numpy(zero_copy_only=False).reshape(-1, 2).astype(str)
+        column = lambda name: table[name].to_numpy(zero_copy_only=False)
+        return cls(column('date').astype('datetime64[D]'), pairs('team1_pids'), pairs('team2_pids'),
+                   np.nan_to_num(column('team1_score').astype(float)), np.nan_to_num(column('team2_score').astype(float)), column('winner'))
+
+    def _since(self, since):
+        rows = self.appearances
+        return rows[rows['date'] >= pd.Timestamp(since)] if since is not None else rows
+
+    def leaders(self, since=None, min_games=1):
+        rows = self._since(since)
+        table = rows.assign(won=rows['result'] == 1.0, diff=rows['points_for'] - rows['points_against']).groupby('player').agg(
+            games=('game', 'size'), wins=('won', 'sum'), win_rate=('result', 'mean'), point_diff=('diff', 'mean'))
+        return table[table['games'] >= min_games].sort_values(['win_rate', 'games'], ascending=False)
+
+    def form(self, weeks=8, today=None):
+        # Win rate per player per week over the last `weeks` weeks (weeks start on Monday)
+        today = pd.Timestamp(today or datetime.date.today())
+        start = (today - pd.Timedelta(weeks=weeks - 1)).to_period('W-SUN').start_time
+        rows = self._since(start)
+        week = rows['date'].dt.to_period('W-SUN').dt.start_time
+        table = rows.assign(week=week).pivot_table(index='player', columns='week', values='result', aggfunc='mean')
+        return table.reindex(columns=pd.date_range(start, today, freq='W-MON')).assign(
+            games=rows.groupby('player').size(), overall=rows.groupby('player')['result'].mean())
+
+    def best_partners(self, since=None, min_games=3):
+        rows = self._since(since)
+        rows = rows[rows['player'] < rows['partner']]  # Each partnership once per game
+        table = rows.assign(won=rows['result'] == 1.0).groupby(['player', 'partner']).agg(
+            games=('game', 'size'), wins=('won', 'sum'), win_rate=('result', 'mean'))
+        return table[table['games'] >= min_games].sort_values(['win_rate', 'games'], ascending=False)
+
+    def head_to_head(self, player, since=None):
+        # The player's record against each opponent they've faced
+        rows = self._since(since)
+        rows = rows[rows['player'] == player]
+        faced = pd.concat([rows[['game', 'result']].assign(opponent=rows['opponent_a']),
+                           rows[['game', 'result']].assign(opponent=rows['opponent_b'])])
+        table = faced.assign(won=faced['result'] == 1.0, lost=faced['result'] == 0.0).groupby('opponent').agg(
+            games=('game', 'size'), wins=('won', 'sum'), losses=('lost', 'sum'))
+        return table.assign(draws=table['games'] - table['wins'] - table['losses']).sort_values('games', ascending=False)
@@ -0,0 +1,181 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# SESSION ARCHIVE
+# ────────────────────────────────────────────────────────────────────────────────
+# Before a reset, the night's game log, session events and final attendance are written as Parquet to
+# `<root>/<table>/date=YYYY-MM-DD/<session>.parquet` and listed in manifest.json. The
+# hive-style layout lets pyarrow.dataset (or pandas / DuckDB) read any range of nights
+# offline without touching the store. pyarrow is imported on first use, so only resets
+# and analytics pay for it.
+
+import datetime
+import json
+import os
+import re
+from collections import Counter
+from datetime import timezone
+
+MANIFEST = "manifest.json"
+
+
+def _schemas():
+    import pyarrow as pa
+    return {
+        'games': pa.schema([
+            ('session_id', pa.string()), ('session_path', pa.string()), ('finish_time', pa.timestamp('us', tz='UTC')),
+            ('court', pa.string()), ('team1_pids', pa.list_(pa.string())), ('team2_pids', pa.list_(pa.string())),
+            ('team1_players', pa.string()), ('team2_players', pa.string()),
+            ('team1_score', pa.int16()), ('team2_score', pa.int16()), ('winner', pa.string()), ('duration_min', pa.int32()),
+        ]),
+        'events': pa.schema([
+            ('session_id', pa.string()), ('session_path', pa.string()), ('seq', pa.int64()), ('kind', pa.string()),
+            ('at', pa.timestamp('us', tz='UTC')), ('data', pa.string()),  # data as JSON, its shape depends on the kind
+        ]),
+        'attendance': pa.schema([
+            ('session_id', pa.string()), ('session_path', pa.string()), ('player_id', pa.string()),
+            ('status', pa.string()), ('position', pa.int32()), ('court', pa.string()),
+        ]),
+    }
+
+
+def _score(text):
+    scores = [int(s) for s in re.findall(r'\d+', text or '')]
+    return (scores + [None, None])[:2]
+
+
+def game_rows(session_id, session_path, logs):
+    # Game log entries (oldest first) -> `games` rows
+    rows = []
+    for log in logs:
+        t1s, t2s = _score(log.get('Score'))
+        duration = re.match(r'\d+', log.get('Duration') or '')
+        rows.append({'session_id': session_id, 'session_path': session_path, 'finish_time': log.get('finish_time'),
+                     'court': str(log.get('Court', '')), 'team1_pids': log.get('team1_pids') or [], 'team2_pids': log.get('team2_pids') or [],
+                     'team1_players': log.get('Team 1 Players'), 'team2_players': log.get('Team 2 Players'),
+                     'team1_score': t1s, 'team2_score': t2s, 'winner': log.get('Winner'),
+                     'duration_min': int(duration.group()) if duration else None})
+    return rows
+
+
+def attendance_rows(session_id, session_path, live_state):
+    # Where everyone present stood when the session was closed: (status, queue position, court)
+    placed = {pid: ('present', None, None) for pid in live_state.get('attendees', [])}
+    for queue in ('main_queue', 'finishers_queue'):
+        placed.update({pid: (queue, n, None) for n, pid in enumerate(live_state.get(queue, []))})
+    for cid, game in live_state.get('active_games', {}).items():
+        placed.update({pid: ('on_court', None, str(cid)) for pid in game.get('player_ids', [])})
+    return [{'session_id': session_id, 'session_path': session_path, 'player_id': pid, 'status': status, 'position': position, 'court': court}
+            for pid, (status, position, court) in placed.items()]
+
+
+def event_rows(session_id, session_path, events):
+    # Session events (see club.session_updates) -> `events` rows
+    return [{'session_id': session_id, 'session_path': session_path, 'seq': event['seq'], 'kind': event['kind'],
+             'at': event.get('at'), 'data': json.dumps(event.get('data', {}), sort_keys=True)}
+            for event in sorted(events, key=lambda e: e['seq'])]
+
+
+def stored_events(table):
+    # `events` rows (a pyarrow Table) -> event dicts again, oldest first, e.g. for replay.py
+    return [{**row, 'data': json.loads(row['data'])} for row in table.sort_by('seq').to_pylist()]
+
+
+def session_day(logs, tz, now=None):
+    # The club-local date the session was played, so a reset next morning files it correctly
+    first = next((log['finish_time'] for log in logs if isinstance(log.get('finish_time'), datetime.datetime)), None)
+    return (first or now or datetime.datetime.now(timezone.utc)).astimezone(tz).date()
+
+
+def archive_session(root, session_path, live_state, logs, tz=timezone.utc, now=None, events=()):
+    # Writes one file per table for the session and records it in the manifest.
+    # Returns the manifest entry, or None if there was nothing to keep.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    session_id = live_state.get('session_id') or 'unknown'
+    rows = {'games': game_rows(session_id, session_path, logs), 'events': event_rows(session_id, session_path, events),
+            'attendance': attendance_rows(session_id, session_path, live_state)}
+    if not any(rows.values()): return None
+
+    day = session_day(logs, tz, now)
+    name = f"{session_path.replace('/', '_')}-{session_id}.parquet"
+    files = {}
+    for table, schema in _schemas().items():
+        directory = os.path.join(root, table, f"date={day.isoformat()}")
+        os.makedirs(directory, exist_ok=True)
+        path, partial = os.path.join(directory, name), os.path.join(directory, f".{name}.tmp")  # Dot files are skipped by readers
+        pq.write_table(pa.Table.from_pylist(rows[table], schema=schema), partial, compression='zstd')
+        os.replace(partial, path)
+        files[table] = os.path.relpath(path, root)
+
+    entry = {'session_id': session_id, 'session_path': session_path, 'date': day.isoformat(),
+             'games': len(rows['games']), 'events': len(rows['events']), 'attendees': len(rows['attendance']), 'files': files,
+             'archived_at': (now or datetime.datetime.now(timezone.utc)).isoformat()}
+    # Re-archiving a session replaces its entry, so the manifest stays one line per night
+    manifest = [e for e in read_manifest(root) if (e['session_id'], e['session_path']) != (session_id, session_path)]
+    write_manifest(root, manifest + [entry])
+    return entry
+
+
+def rating_games(root, session_prefix=None, skip_session=None):
+    # Archived games as ratings.replay() input, oldest first. `session_prefix` keeps the
+    # sessions that share a roster; `skip_session` leaves out a night still in the live log.
+    import pyarrow.compute as pc
+    table = load(root, 'games', columns=['session_id', 'session_path', 'finish_time', 'team1_pids', 'team2_pids', 'winner'])
+    if session_prefix: table = table.filter(pc.starts_with(table['session_path'], session_prefix))
+    if skip_session: table = table.filter(pc.not_equal(table['session_id'], skip_session))
+    return [(row['team1_pids'], row['team2_pids'], row['winner']) for row in table.sort_by('finish_time').to_pylist()]
+
+
+def regulars(root, session_path, nights=8, min_nights=2):
+    # Players at `min_nights` or more of the venue's last `nights` archived sessions, most
+    # regular first. A night counts everyone who checked in, not just who was left at reset
+    # (attendance alone covers nights from before events were archived).
+    sessions = [e for e in read_manifest(root) if e['session_path'] == session_path][-nights:]
+    if not sessions: return []
+    start, recent = datetime.date.fromisoformat(min(e['date'] for e in sessions)), {e['session_id'] for e in sessions}
+    present = {sid: set() for sid in recent}
+    events = load(root, 'events', start=start, session_path=session_path, columns=['session_id', 'kind', 'data'])
+    for sid, kind, data in zip(*(events[c].to_pylist() for c in ('session_id', 'kind', 'data'))):
+        if kind == 'check_in' and sid in recent: present[sid].update(json.loads(data)['pids'])
+    attendance = load(root, 'attendance', start=start, session_path=session_path, columns=['session_id', 'player_id'])
+    for sid, pid in zip(attendance['session_id'].to_pylist(), attendance['player_id'].to_pylist()):
+        if sid in recent: present[sid].add(pid)
+    seen = Counter(pid for pids in present.values() for pid in pids)
+    return [pid for pid, count in seen.most_common() if count >= min_nights]
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST)) as f: return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def manifest_stamp(root):
+    # Changes whenever a session is archived; a cheap cache key for readers of the archive
+    try:
+        stat = os.stat(os.path.join(root, MANIFEST))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_manifest(root, entries):
+    path = os.path.join(root, MANIFEST)
+    with open(path + ".tmp", "w") as f: json.dump(entries, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load(root, table, start=None, end=None, session_path=None, columns=None):
+    # Archived rows for a date range (inclusive) as a pyarrow Table, read straight from disk
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    schema = _schemas()[table].append(pa.field('date', pa.string()))
+    directory = os.path.join(root, table)
+    if not os.path.isdir(directory): return schema.empty_table().select(columns or schema.names)
+    partitioning = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+    dataset = ds.dataset(directory, format='parquet', partitioning=partitioning, schema=schema)
+    condition = None
+    for clause in (ds.field('date') >= start.isoformat() if start else None, ds.field('date') <= end.isoformat() if end else None,
+                   ds.field('session_path') == session_path if session_path else None):
+        if clause is not None: condition = clause if condition is None else condition & clause
+    return dataset.to_table(columns=columns, filter=condition)
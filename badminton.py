@@ -1,22 +1,36 @@
-import streamlit as st
 import time
+SCRIPT_STARTED = time.perf_counter()
+
+import streamlit as st
 import datetime
 from datetime import timezone, timedelta
-import pandas as pd
-import random
-import string
+import copy
+import functools
+import importlib
+import itertools
+import uuid
+import json
+import sys
+import threading
 from typing import List, Dict, Any, Optional
-from itertools import combinations
-from collections import defaultdict
-
-# --- Firebase Imports ---
-import firebase_admin
-from firebase_admin import credentials, firestore
-from streamlit_autorefresh import st_autorefresh
-
-# --- Additional Imports ---
-import extra_streamlit_components as stx
-from streamlit_dnd import st_dnd  # Drag-and-Drop functionality
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+
+import storage
+import club
+import ratings
+import metrics
+import writes
+
+# pandas, firebase_admin, the matchmaking/scheduler engines (numpy) and the component
+# libraries are imported on first use via lazy_import, so a player phone's first paint
+# doesn't pay for the stats, court and Firestore machinery it never renders.
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is None:
+        with metrics.REGISTRY.operation(f"import {name}"):
+            module = importlib.import_module(name)
+    return module
 
 # ────────────────────────────────────────────────────────────────────────────────
 # CONFIGURATION & INITIAL DATA
@@ -25,7 +39,18 @@ from streamlit_dnd import st_dnd  # Drag-and-Drop functionality
 st.set_page_config(page_title="Acers Badminton Club 2025", layout="wide", initial_sidebar_state="expanded")
 
 # --- Constants & Secrets ---
-MAX_COURTS = 4
+MAX_COURTS = int(st.secrets.get("app_secrets", {}).get("max_courts", 4))
+COURT_POLL_SECONDS = 5    # How often a court tablet checks the shared state version
+PLAYER_POLL_SECONDS = 10  # Same for player phones
+QUEUE_VIEW_BAND = 8       # Player phones poll one step slower per this many places back in the queue
+QUEUE_VIEW_MAX_POLL_SECONDS = 30
+BULK_MATCH_SCORE = 0.75   # An unknown CSV name defaults to an existing player only when this close
+QUEUE_POLL_SECONDS = 5    # Queue column and sidebar counts on a court tablet
+STATS_POLL_SECONDS = 30   # Stats and log tabs; they only move when a game is logged
+FRAME_KEYS = ('attendees', 'session_id')  # The only state a court tablet needs a full rerun for
+LOG_PAGE_SIZE = 25
+CLUB_TZ = ZoneInfo("Europe/London")
+ARCHIVE_DIR = st.secrets.get("app_secrets", {}).get("archive_dir", "archive")  # Parquet history of reset sessions
 try:
     ADMIN_PASSWORD = st.secrets.app_secrets.admin_password
     ADMIN_USERS = st.secrets.app_secrets.admin_users
@@ -76,56 +101,294 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-# --- Firebase Integration ---
+# --- Storage Backend ---
+# `storage_backend = "local"` in app_secrets runs on an in-process SQLite store instead
+# of Firestore; `local_db_path` picks the file (default: in-memory for this process).
+STORAGE_BACKEND = st.secrets.app_secrets.get("storage_backend", "firestore")
+
 def init_firebase():
-    try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(dict(st.secrets["firebase_credentials"]))
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
-    except Exception as e:
-        st.error(f"Firebase initialization failed: {e}"); return None
+    firebase_admin = lazy_import("firebase_admin")
+    from firebase_admin import credentials, firestore
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(dict(st.secrets["firebase_credentials"]))
+        firebase_admin.initialize_app(cred)
+    return storage.FirestoreStore(firestore.client())
+
+# One client per process rather than per rerun; a failure raises, so it isn't cached
+# and the next run tries again
+@st.cache_resource
+def init_store():
+    if STORAGE_BACKEND == "local":
+        return storage.LocalStore.open(st.secrets.app_secrets.get("local_db_path", ":memory:"))
+    return init_firebase()
+
+try:
+    db = init_store()
+except Exception as e:
+    st.error(f"Firebase initialization failed: {e}"); db = None
 
-db = init_firebase()
+def state_slice(live_state, keys):
+    return json.dumps([live_state.get(k) for k in keys], sort_keys=True, default=str)
+
+# --- Club & Venue ---
+# `?club=acers&venue=sports-hall` picks an independent session; without them the app runs
+# the original single session. `roster_scope = "club"` in app_secrets gives each club its
+# own roster instead of the shared one. Caches below are keyed by these paths.
+CLUB_ID, VENUE_ID = club.slug(st.query_params.get("club")), club.slug(st.query_params.get("venue"))
+ROSTER_SCOPE = st.secrets.app_secrets.get("roster_scope", "shared")
+CLIENT_MODE = "court" if st.query_params.get("mode") == "court" else "player"
 
 # Persistent Player Data and Session-Specific Data
-PLAYERS_COLLECTION_REF = db.collection("players") if db else None
-SESSION_DOC_REF = db.collection("session").document("live_state") if db else None
-LOG_COLLECTION_REF = db.collection("session").document("live_state").collection("game_log") if db else None
+REFS = club.SessionRefs(db, *club.session_paths(CLUB_ID, VENUE_ID, ROSTER_SCOPE)) if db else None
+SESSION_DOC_REF = REFS.session if db else None
+LOG_COLLECTION_REF = REFS.log if db else None
+PAIR_STATS_REF = REFS.pair_stats if db else None
+MATCHUP_STATS_REF = REFS.matchup_stats if db else None
+
+@st.cache_resource
+def get_roster_cache(players_path):
+    return club.RosterCache(REFS)
+
+def get_roster():
+    return get_roster_cache(REFS.players_path)
+
+def get_player_index():
+    if not REFS: return club.PlayerIndex({})
+    return get_roster().get()
 
-@st.cache_data(ttl=60)
 def get_players_db():
-    if not PLAYERS_COLLECTION_REF: return {}
-    docs = PLAYERS_COLLECTION_REF.stream()
-    return {doc.id: doc.to_dict() for doc in docs}
+    return get_player_index().players
+
+def queue_names(roster, pids):
+    index = roster.get()
+    return [record.name if record else "..." for record in map(index.record, pids)]
+
+# Lets session writes keep the public queue view (club.queue_view) current
+if REFS: REFS.names, REFS.courts = functools.partial(queue_names, get_roster()), [str(i + 1) for i in range(MAX_COURTS)]
+
+# One process-wide mirror of `session/live_state`, fed by a Firestore snapshot listener.
+# Every browser session reads this in-memory copy instead of doing its own document read,
+# so reads scale with the number of state changes rather than clients x poll rate.
+@st.cache_resource
+def listener_versions():
+    # Shared by every listener, so versions keep rising when a dead one is replaced
+    return itertools.count(1)
+
+
+class LiveStateListener:
+    def __init__(self, refs):
+        self._refs = refs
+        self._versions = listener_versions()
+        self._changed = threading.Condition()
+        self._state = None
+        self.version = 0
+        self._watch = refs.session.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        doc = docs[0] if docs else None
+        if doc is None or not doc.exists:
+            # Default state for a new session; the listener fires again once it lands
+            club.start_session(self._refs)
+            return
+        state = doc.to_dict()
+        # Ensure queue keys exist
+        state.setdefault('finishers_queue', []); state.setdefault('main_queue', [])
+        state.setdefault('active_games', {})
+        state[club.UPDATE_TIME_KEY] = doc.update_time
+        with self._changed:
+            self._state = state
+            self.version = next(self._versions)
+            self._changed.notify_all()
+
+    def snapshot(self, timeout=10.0):
+        with self._changed:
+            if self._state is None: self._changed.wait_for(lambda: self._state is not None, timeout)
+            if self._state is None: return self.version, None
+            # Sessions mutate their copy (e.g. popping a finished court), so never hand out ours
+            return self.version, copy.deepcopy(self._state)
+
+    def wait_for_change(self, since_version, timeout=2.0):
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version > since_version, timeout)
+
+    def slice_of(self, keys):
+        # Cheap view of part of the state, so a fragment can tell whether *its* bit moved
+        with self._changed:
+            return state_slice(self._state or {}, keys)
+
+    @property
+    def active(self):
+        return self._watch is not None and self._watch.is_active
+
+
+@st.cache_resource
+def get_session_listener(session_path):
+    return LiveStateListener(REFS)
+
+
+def get_live_state_listener():
+    return get_session_listener(REFS.session_path)
+
 
 def get_live_state():
     if not SESSION_DOC_REF: return {}
-    doc = SESSION_DOC_REF.get()
-    if doc.exists:
-        state = doc.to_dict()
-        # Ensure queue keys exist
-        if 'finishers_queue' not in state: state['finishers_queue'] = []
-        if 'main_queue' not in state: state['main_queue'] = []
-        return state
-    else:
-        # Default state for a new session
-        default_state = {
-            'attendees': [], 'finishers_queue': [], 'main_queue': [], 'active_games': {},
-            'session_password': generate_password(), 'last_chooser_id': None
-        }
-        SESSION_DOC_REF.set(default_state)
-        return default_state
+    listener = get_live_state_listener()
+    if not listener.active:
+        # The watch stream died (e.g. credentials rotated); start a fresh one
+        get_session_listener.clear(REFS.session_path)
+        listener = get_live_state_listener()
+    version, state = listener.snapshot()
+    if state is None:
+        # Listener hasn't delivered yet; fall back to a one-off read
+        state = club.load_live_state(REFS)
+    st.session_state.live_state_version = version
+    # Show queued writes as if they had landed
+    return get_write_queue().overlay(state)
+
+
+# Player phones follow the public queue view (see club.queue_view) instead: a few names
+# and a version rather than the whole session and the roster.
+class QueueViewListener:
+    def __init__(self, refs):
+        self._refs = refs
+        self._changed = threading.Condition()
+        self._view = None
+        self._watch = refs.queue_view.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        doc = docs[0] if docs else None
+        if doc is None or not doc.exists:
+            # Session from before the view existed; publish it and the listener fires again
+            club.publish_queue_view(self._refs)
+            return
+        with self._changed:
+            self._view = doc.to_dict()
+            self._changed.notify_all()
+
+    def snapshot(self, timeout=10.0):
+        with self._changed:
+            if self._view is None: self._changed.wait_for(lambda: self._view is not None, timeout)
+            return dict(self._view or {})
+
+    @property
+    def version(self):
+        with self._changed: return (self._view or {}).get('version')
+
+    @property
+    def active(self):
+        return self._watch is not None and self._watch.is_active
+
 
-def generate_password(): return "".join(random.choices(string.digits, k=6))
+@st.cache_resource
+def get_queue_view_listener(session_path):
+    return QueueViewListener(REFS)
+
+
+def get_queue_view():
+    if not REFS: return {}
+    if not get_queue_view_listener(REFS.session_path).active: get_queue_view_listener.clear(REFS.session_path)
+    return get_queue_view_listener(REFS.session_path).snapshot()
+
+
+def queue_poll_seconds(position):
+    # Near the front the wait is short and worth following closely; further back a
+    # phone can check less often. Not in the queue (e.g. on court): the normal cadence.
+    if position is None: return PLAYER_POLL_SECONDS
+    return min(QUEUE_VIEW_MAX_POLL_SECONDS, QUEUE_POLL_SECONDS * (1 + position // QUEUE_VIEW_BAND))
+
+
+def rerun_on_queue_view_change(interval, seen_version):
+    def _check():
+        if get_queue_view_listener(REFS.session_path).version != seen_version: st.rerun()
+    st.fragment(_check, run_every=interval)()
+
+
+# Cheap fragment that polls the in-memory version and only reruns the app when it moved.
+# With `keys`, only a change to that slice of the state reruns the app; the fragments
+# further down keep everything else current on their own cadence.
+def rerun_on_state_change(interval, live_state=None, keys=None):
+    seen_version = st.session_state.get('live_state_version', 0)
+    seen_slice = state_slice(live_state, keys) if keys else None
+
+    def _check():
+        listener = get_live_state_listener()
+        if listener.version == seen_version: return
+        if keys is None or listener.slice_of(keys) != seen_slice: st.rerun()
+    st.fragment(_check, run_every=interval)()
+
+
+# --- Background Writes ---
+# Operator and player taps queue their mutation (see writes.py) and rerun straight away;
+# the queued change is previewed on the live state until the listener delivers it.
+@st.cache_resource
+def get_session_write_queue(session_path):
+    # The listener is looked up on every call: get_live_state replaces it if its watch dies
+    refs, listener = REFS, lambda: get_session_listener(session_path)
+    listener()  # Started up front as before, which also opens the session if there isn't one
+    return writes.WriteQueue(lambda: listener().snapshot(timeout=2)[1] if listener().active else None,
+                             lambda: listener().version, lambda: club.load_live_state(refs))
+
+
+def get_write_queue():
+    return get_session_write_queue(REFS.session_path)
+
+
+def client_id():
+    if 'client_id' not in st.session_state: st.session_state.client_id = uuid.uuid4().hex
+    return st.session_state.client_id
+
+
+def queue_write(label, run, items, preview, key=None, on_success=None):
+    return get_write_queue().submit(label, run, items, preview, key=key, owner=client_id(), on_success=on_success)
+
+
+def show_write_failures():
+    for job in get_write_queue().take_failures(client_id()):
+        st.toast(f"{job.label}: {job.error}", icon="⚠️")
+
+
+def rerun_after_write():
+    # Give the snapshot listener a moment to deliver our own write so the next run isn't stale
+    get_live_state_listener().wait_for_change(st.session_state.get('live_state_version', 0))
+    st.rerun()
+
+
+@st.cache_data(max_entries=8)
+def get_partnership_stats(session_path, session_id, games_logged):
+    # Keyed on the session's game counter, so it only re-reads after a game is logged
+    return [doc.to_dict() for doc in PAIR_STATS_REF.stream()], [doc.to_dict() for doc in MATCHUP_STATS_REF.stream()]
+
+@st.cache_data(max_entries=8)
+def get_recent_games(session_path, session_id, games_logged):
+    # Partner/opponent history for matchmaking; only re-read after a game is logged
+    return club.recent_games(REFS, lazy_import("matchmaking").RECENT_GAMES)
 
 def get_cookie_manager():
-    return stx.CookieManager()
+    # The cookie component only has to report the browser's cookies until the session
+    # knows who is logged in; after that the session's instance is reused (set/delete
+    # render their own component calls)
+    logged_in = st.session_state.get('court_operator_logged_in') or st.session_state.get('player_logged_in_name')
+    if not logged_in or 'cookie_manager' not in st.session_state:
+        st.session_state.cookie_manager = lazy_import("extra_streamlit_components").CookieManager()
+    return st.session_state.cookie_manager
+
+# --- Instrumentation ---
+# Render functions are timed per client mode, and the store reads/writes they cause are
+# charged to them (see metrics.py); admins see the totals under "📈 Performance".
+storage.add_observer(metrics.REGISTRY.record_io)
+
+def instrumented(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with metrics.REGISTRY.operation(fn.__name__, CLIENT_MODE):
+            return fn(*args, **kwargs)
+    return wrapper
 
 # ────────────────────────────────────────────────────────────────────────────────
 # PLAYER & COURT MODES
 # ────────────────────────────────────────────────────────────────────────────────
-def render_player_mode(live_state, players_db, cookie_manager):
+@instrumented
+def render_player_mode(cookie_manager):
     if 'player_logged_in_name' not in st.session_state: st.session_state.player_logged_in_name = None
 
     if not st.session_state.player_logged_in_name:
@@ -138,6 +401,7 @@ def render_player_mode(live_state, players_db, cookie_manager):
             submitted = st.form_submit_button("Mark My Attendance")
 
             if submitted:
+                live_state = get_live_state()  # Only needed to check in; the queue below uses the public view
                 if not typed_name:
                     st.error("Please enter your name.")
                 elif session_password != live_state.get('session_password'):
@@ -145,50 +409,45 @@ def render_player_mode(live_state, players_db, cookie_manager):
                 else:
                     standardized_name = typed_name.strip().title()
                     # Find player by name in the persistent database
-                    found_player_id, found_player = next(((pid, p) for pid, p in players_db.items() if p.get('name', '').lower() == standardized_name.lower()), (None, None))
-
-                    if not found_player:
-                        with st.spinner(f"Welcome, {standardized_name}! Creating your player profile..."):
-                            # Create a new persistent player profile
-                            found_player_id = "".join(random.choices(string.ascii_letters + string.digits, k=20))
-                            found_player = {
-                                'name': standardized_name,
-                                'gender': "Men",  # Default or ask
-                                'skill': 2,
-                                'chooser_count': 0,
-                                'games_played': 0,
-                                'wins': 0
-                            }
-                            PLAYERS_COLLECTION_REF.document(found_player_id).set(found_player)
-                            st.cache_data.clear()  # Clear cache to fetch new player
-
-                    # Mark player as present for the session
-                    player_id_str = str(found_player_id)
-                    if player_id_str not in live_state.get('attendees', []):
-                        SESSION_DOC_REF.update({
-                            'attendees': firestore.ArrayUnion([player_id_str]),
-                            'main_queue': firestore.ArrayUnion([player_id_str])
-                        })
-
-                    st.session_state.player_logged_in_name = found_player['name']
-                    cookie_manager.set('player_name', found_player['name'], expires_at=datetime.datetime.now() + timedelta(hours=3))
-                    st.toast(f"Welcome, {found_player['name']}! You're checked in.", icon="✅")
-                    st.rerun()
+                    index = get_player_index()
+                    found_player_id = index.pid_for(standardized_name)
+                    if found_player_id:
+                        log_in_player(found_player_id, cookie_manager)
+                    # A near miss is far more likely a typo than a new member; ask before
+                    # creating a duplicate profile
+                    elif close := index.search(standardized_name, limit=3):
+                        st.session_state.login_suggestions = (standardized_name, [pid for pid, _ in close])
+                    else:
+                        log_in_player(create_player_profile(standardized_name), cookie_manager)
+
+        if suggestions := st.session_state.get('login_suggestions'):
+            typed, pids = suggestions
+            st.warning(f"We couldn't find **{typed}**. Did you mean:")
+            for pid, name in zip(pids, get_player_index().names_for(pids)):
+                if st.button(name, key=f"login_pick_{pid}", use_container_width=True):
+                    log_in_player(pid, cookie_manager)
+            if st.button(f"No, I'm new: create a profile for {typed}", key="login_new", use_container_width=True):
+                log_in_player(create_player_profile(typed), cookie_manager)
 
     else:
         st.title(f"✅ Attendance Marked, {st.session_state.player_logged_in_name}!")
         st.subheader("Current Waiting Queue")
 
-        waiting_pids = live_state.get('finishers_queue', []) + live_state.get('main_queue', [])
-        waiting_players = get_players_from_ids(waiting_pids, players_db)
+        view = get_queue_view()
+        waiting, me = view.get('waiting', []), st.session_state.player_logged_in_name
+        position = waiting.index(me) if me in waiting else None
 
-        if not waiting_players:
+        if not waiting:
             st.info("The waiting list is empty.")
         else:
+            # Estimates are worked out once per queue change (club.queue_etas); here they only meet the clock
+            waits = [wait_label(eta) for eta in view.get('eta', [])] + [""] * len(waiting)
+            if position is not None:
+                st.caption(f"You're number {position + 1} in the queue" + (f", on court {waits[position]}." if waits[position] else "."))
             pills = [
-                f"<div class='player-pill' style='{'background-color: #d0eaff; border: 2px solid #006aff;' if p and p['name'] == st.session_state.player_logged_in_name else ''}'>"
-                f"{i+1}. {p['name'] if p else '...'}</div>"
-                for i, p in enumerate(waiting_players)
+                f"<div class='player-pill' style='{'background-color: #d0eaff; border: 2px solid #006aff;' if name == me else ''}'>"
+                f"{i+1}. {name}{f' · {waits[i]}' if waits[i] else ''}</div>"
+                for i, name in enumerate(waiting)
             ]
             st.markdown("".join(pills), unsafe_allow_html=True)
 
@@ -198,9 +457,50 @@ def render_player_mode(live_state, players_db, cookie_manager):
             cookie_manager.delete('player_name')
             st.rerun()
 
-        st_autorefresh(interval=10000, key="player_refresher")
+        # Reruns only when the view's version moves, checking less often further back
+        rerun_on_queue_view_change(queue_poll_seconds(position), view.get('version'))
+
+
+def wait_label(eta):
+    if eta is None: return ""  # Beyond the estimate's horizon
+    minutes = round((club.parse_start_time(eta) - datetime.datetime.now(timezone.utc)).total_seconds() / 60)
+    return "any minute now" if minutes <= 1 else f"in ~{minutes} min"
+
+
+def create_player_profile(name):
+    with st.spinner(f"Welcome, {name}! Creating your player profile..."):
+        # Create a new persistent player profile
+        pid, player = club.create_player(REFS, name)
+        get_roster().add(pid, player)
+    return pid
+
+
+def log_in_player(pid, cookie_manager):
+    name = get_player_index().record(pid).name
+    # Mark player as present for the session; bursts of check-ins share a write
+    queue_write("Check-in", lambda state, pids: club.check_in_many(REFS, state, pids), [str(pid)],
+                club.preview_check_in, key="check_in")
+
+    st.session_state.login_suggestions = None
+    st.session_state.player_logged_in_name = name
+    cookie_manager.set('player_name', name, expires_at=datetime.datetime.now() + timedelta(hours=3))
+    st.toast(f"Welcome, {name}! You're checked in.", icon="✅")
+    st.rerun()
 
 
+def player_picker(label, pids, key):
+    # Multiselect over `pids` with a fuzzy finder: typing narrows the options to the names
+    # holding that part (a surname, a typo'd first name), and anything already picked stays available
+    index = get_player_index()
+    query = st.text_input("🔍 Find player", key=f"{key}_find", placeholder="Type part of a name")
+    options = list(pids)
+    if query:
+        picked = [pid for pid in st.session_state.get(key, []) if pid in options]
+        options = list(dict.fromkeys(picked + [pid for pid, _ in index.search(query, limit=10, within=set(options), partial=True)]))
+    return st.multiselect(label, options, format_func=lambda pid: index.record(pid).name, key=key)
+
+
+@instrumented
 def render_court_mode(live_state, players_db, cookie_manager):
     if 'court_operator_logged_in' not in st.session_state: st.session_state.court_operator_logged_in = None
     if not st.session_state.court_operator_logged_in:
@@ -227,7 +527,7 @@ def render_court_mode(live_state, players_db, cookie_manager):
         return
     render_sidebar(live_state, players_db, cookie_manager)
     render_main_dashboard(live_state, players_db)
-    st_autorefresh(interval=5000, key="court_refresher")
+    rerun_on_state_change(COURT_POLL_SECONDS, live_state, FRAME_KEYS)
 
 
 def get_players_from_ids(pids: List[str], players_db: dict) -> List[dict]:
@@ -235,18 +535,22 @@ def get_players_from_ids(pids: List[str], players_db: dict) -> List[dict]:
 
 
 def clear_session_data():
-    if SESSION_DOC_REF:
-        SESSION_DOC_REF.set({
-            'attendees': [], 'finishers_queue': [], 'main_queue': [], 'active_games': {},
-            'session_password': generate_password(), 'last_chooser_id': None
-        })
-    if LOG_COLLECTION_REF:
-        for doc in LOG_COLLECTION_REF.stream(): doc.reference.delete()
-
-
+    # Archive first: if that fails the session is left as it was, so no history is lost
+    if not REFS: return None
+    state = club.load_live_state(REFS)
+    log_docs, event_docs = club.session_log(REFS), club.session_events(REFS)
+    entry = lazy_import("archive").archive_session(ARCHIVE_DIR, REFS.session_path, state,
+                                                   [doc.to_dict() for doc in log_docs], CLUB_TZ,
+                                                   events=[doc.to_dict() for doc in event_docs if doc.to_dict().get('session_id') == state.get('session_id')])
+    club.clear_session(REFS, log_docs, event_docs)
+    return entry
+
+
+@instrumented
 def render_sidebar(live_state, players_db, cookie_manager):
     with st.sidebar:
         st.title("🏸 Acers Club")
+        if CLUB_ID: st.caption(f"{CLUB_ID} · {VENUE_ID or 'main'}")
         st.markdown(f"### Operator: **{st.session_state.court_operator_logged_in}**")
         if st.button("Logout Operator", use_container_width=True):
             st.session_state.logout_in_progress = True
@@ -254,29 +558,123 @@ def render_sidebar(live_state, players_db, cookie_manager):
             cookie_manager.delete('court_operator')
             st.rerun()
         st.markdown("---")
-        all_waiting_pids = live_state.get('finishers_queue', []) + live_state.get('main_queue', [])
-        attendees, waiting = len(live_state.get('attendees', [])), len(all_waiting_pids)
-        on_court = sum(len(g.get('player_ids', [])) for g in live_state.get('active_games', {}).values())
-        c1, c2, c3 = st.columns(3); c1.metric("Present", attendees); c2.metric("Waiting", waiting); c3.metric("On Court", on_court)
+        render_session_metrics()
         st.markdown("---")
         if st.session_state.court_operator_logged_in in ADMIN_USERS:
             st.header("Admin Controls")
-            if st.button("🔄 Reset Current Session", use_container_width=True, type="secondary", help="Clears attendance, queues, and game logs, but keeps player profiles and stats."):
-                clear_session_data()
-                st.toast("Session has been reset!", icon="🧹")
+            if st.button("🔄 Reset Current Session", use_container_width=True, type="secondary", help="Archives tonight's games, then clears attendance, queues, and game logs, but keeps player profiles and stats."):
+                try:
+                    with st.spinner("Archiving and resetting..."): entry = clear_session_data()
+                except Exception as e:
+                    st.error(f"Couldn't archive the session, so it was not reset: {e}")
+                else:
+                    st.toast(f"Session has been reset! Archived {entry['games'] if entry else 0} games.", icon="🧹")
+                    rerun_after_write()
+            if st.button("📊 Rebuild Stats from Game Log", use_container_width=True, help="Recomputes partnership and head-to-head stats from the logged games."):
+                with st.spinner("Rebuilding stats..."):
+                    rebuilt = club.rebuild_partnership_stats(REFS, get_player_index())
+                    get_partnership_stats.clear(REFS.session_path, live_state.get('session_id'), live_state.get('games_logged', 0))
+                st.toast(f"Rebuilt {rebuilt} stat records.", icon="📊")
+                rerun_after_write()
+            if st.button("📈 Recompute Ratings", use_container_width=True, help="Replays the archived nights and tonight's games to recompute player ratings."):
+                with st.spinner("Recomputing ratings..."):
+                    # Every night that shares this roster: the whole archive, or just this club's
+                    roster_prefix = REFS.players_path[:-len("players")] or None
+                    history = lazy_import("archive").rating_games(ARCHIVE_DIR, roster_prefix, live_state.get('session_id'))
+                    rebuilt = club.rebuild_ratings(REFS, history)
+                    get_roster().invalidate()
+                    get_leaderboard.clear()  # Keyed on games logged, which a recompute doesn't move
+                st.toast(f"Recomputed {rebuilt} player ratings.", icon="📈")
                 st.rerun()
+            with st.expander("📋 Bulk Check-in"):
+                render_bulk_check_in(live_state)
+            with st.expander("📈 Performance"):
+                render_metrics_panel()
+
+
+@st.cache_data(max_entries=4)
+def get_regulars(archive_dir, session_path, manifest_stamp):
+    return lazy_import("archive").regulars(archive_dir, session_path)
+
+
+def render_bulk_check_in(live_state):
+    # Check in a whole group with one session write instead of a login per player
+    index, present = get_player_index(), set(live_state.get('attendees', []))
+    source = st.radio("From", ["Regulars", "CSV"], horizontal=True, key="bulk_source")
+    pids, new_names = [], []
+    if source == "Regulars":
+        regulars = get_regulars(ARCHIVE_DIR, REFS.session_path, lazy_import("archive").manifest_stamp(ARCHIVE_DIR))
+        regulars = [pid for pid in regulars if pid not in present and index.record(pid)]
+        if not regulars: st.caption("No regulars to add; they come from the archived nights at this venue.")
+        pids = st.multiselect("Regulars", regulars, default=regulars, format_func=lambda pid: index.record(pid).name, key="bulk_regulars")
+    else:
+        upload = st.file_uploader("CSV of names", type="csv", key="bulk_csv",
+                                  help="The first row is a header; names come from a `Name` or `Player` column, else the first.")
+        if upload:
+            column, names = club.names_from_csv(upload.getvalue().decode("utf-8-sig"))
+            found = {name: index.pid_for(name) for name in names}
+            unknown = [name for name, pid in found.items() if not pid]
+            st.caption(f"Reading names from the “{column}” column.")
+            # Near misses ("Jon Smith" for "John Smith") are offered; only a very close one is picked by default
+            for n, name in enumerate(unknown):
+                matches = index.search(name, limit=3)
+                if matches:
+                    found[name] = st.selectbox(f"“{name}” isn't on the roster", [None] + [pid for pid, _ in matches], key=f"bulk_match_{n}",
+                                               index=1 if matches[0][1] >= BULK_MATCH_SCORE else 0,
+                                               format_func=lambda pid, name=name: index.record(pid).name if pid else f"New profile: {name}")
+            new_names = [name for name, pid in found.items() if not pid]
+            pids = list(dict.fromkeys(pid for pid in found.values() if pid and pid not in present))
+            st.caption(f"{len(pids)} on the roster, {len(names) - len(pids) - len(new_names)} already here, {len(new_names)} new.")
+            if new_names: st.caption("New profiles: " + ", ".join(new_names))
+
+    if st.button(f"Check in {len(pids) + len(new_names)} players", disabled=not (pids or new_names), use_container_width=True, key="bulk_go"):
+        if new_names:
+            with st.spinner(f"Creating {len(new_names)} profiles..."):
+                created = club.create_players(REFS, new_names)
+                get_roster().add_many(created)  # One roster update for the lot, no re-stream
+            pids = pids + list(created)
+        queue_write("Bulk check-in", lambda state, pids: club.check_in_many(REFS, state, pids), pids,
+                    club.preview_check_in, key="check_in")
+        st.toast(f"Checking in {len(pids)} players.", icon="✅"); st.rerun()
+
+
+def render_metrics_panel():
+    pd = lazy_import("pandas")
+    snapshot = metrics.REGISTRY.snapshot()
+    st.caption(f"This server process, last {snapshot['uptime_s'] / 60:.0f} min. Timings cover the last {metrics.WINDOW} calls of each render.")
+    if snapshot['operations']:
+        st.dataframe(pd.DataFrame(snapshot['operations']), use_container_width=True, hide_index=True)
+    c1, c2 = st.columns(2)
+    c1.download_button("JSON", metrics.REGISTRY.to_json(), file_name="badminton-metrics.json", mime="application/json", use_container_width=True)
+    c2.download_button("Prometheus", metrics.REGISTRY.to_prometheus(), file_name="badminton-metrics.prom", mime="text/plain", use_container_width=True)
+    if st.button("Reset Metrics", use_container_width=True): metrics.REGISTRY.reset(); st.rerun()
+
+
+@st.fragment(run_every=QUEUE_POLL_SECONDS)
+@instrumented
+def render_session_metrics():
+    live_state = get_live_state()
+    all_waiting_pids = live_state.get('finishers_queue', []) + live_state.get('main_queue', [])
+    attendees, waiting = len(live_state.get('attendees', [])), len(all_waiting_pids)
+    on_court = sum(len(g.get('player_ids', [])) for g in live_state.get('active_games', {}).values())
+    c1, c2, c3 = st.columns(3); c1.metric("Present", attendees); c2.metric("Waiting", waiting); c3.metric("On Court", on_court)
+    if pending := get_write_queue().pending(): st.caption(f"⏳ Saving {pending} change{'s' if pending > 1 else ''}...")
+    show_write_failures()
 
 
+# Court mode is split into fragments that each refresh on their own cadence from the
+# in-memory live state, so a score logged on court 3 doesn't rebuild the whole page.
+# Fragment arguments are frozen at the last full run, so each one re-reads the state.
 def render_main_dashboard(live_state, players_db):
     courts_col, queue_col = st.columns([3, 1])
     with courts_col:
-        tabs = st.tabs(["🏟️ Courts", "📊 Player Stats", "📋 Game Log", "👋 Check-out"])
+        tabs = st.tabs(["🏟️ Courts", "📊 Player Stats", "📋 Game Log", "👋 Check-out", "📅 Season"])
 
         with tabs[0]:  # Courts Tab
-            render_courts_view(live_state, players_db)
+            render_courts_view()
 
         with tabs[1]:  # Player Stats Tab
-            render_player_stats(players_db)
+            render_player_stats()
 
         with tabs[2]:  # Game Log Tab
             render_game_log()
@@ -284,75 +682,110 @@ def render_main_dashboard(live_state, players_db):
         with tabs[3]:  # Check-out Tab
             render_checkout_view(live_state, players_db)
 
+        with tabs[4]:  # Season Tab
+            render_season_view()
+
     with queue_col:
-        render_queue_view(live_state, players_db)
+        render_queue_view()
 
 
 # --- Main Dashboard Tabs ---
-def render_courts_view(live_state, players_db):
+@instrumented
+def render_courts_view():
     st.header("Active Courts")
+    if st.toggle("🗓️ Plan all free courts together", key="global_scheduler", help="Fills every free court in one go instead of one chooser at a time."):
+        render_court_plan()
     court_grid_cols = st.columns(2)
     for i in range(MAX_COURTS):
-        cid_str, game = str(i + 1), live_state.get('active_games', {}).get(str(i + 1))
         with court_grid_cols[i % 2]:
             with st.container(border=True):
-                st.markdown(f"<h4>Court {cid_str}</h4>", unsafe_allow_html=True)
-                if game:
-                    render_active_game(cid_str, game, players_db)
-                else:
-                    render_free_court(cid_str, live_state, players_db)
+                render_court_card(str(i + 1))
+
+
+@st.cache_data(max_entries=4)
+def get_court_plan(waiting, free_courts, session_path, session_id, games_logged, _players_db):
+    # Keyed on the queue and the free courts, so ticks with nothing new reuse the last plan
+    return lazy_import("scheduler").plan(waiting, _players_db, free_courts, get_recent_games(session_path, session_id, games_logged))
+
+
+@st.fragment(run_every=COURT_POLL_SECONDS)
+@instrumented
+def render_court_plan():
+    live_state, index = get_live_state(), get_player_index()
+    free_courts = tuple(str(i + 1) for i in range(MAX_COURTS) if str(i + 1) not in live_state.get('active_games', {}))
+    plans = get_court_plan(tuple(club.waiting_pids(live_state)), free_courts, REFS.session_path, live_state.get('session_id'),
+                           live_state.get('games_logged', 0), index.players)
+    with st.container(border=True):
+        if not plans:
+            st.info("No free court can be filled right now."); return
+        for plan in plans:
+            st.markdown(f"**Court {plan.cid}:** {' & '.join(index.names_for(plan.team1))}  vs  {' & '.join(index.names_for(plan.team2))}")
+        if st.button(f"Start {len(plans)} Planned Game{'s' if len(plans) > 1 else ''}", key="start_plan", use_container_width=True, type="primary"):
+            queue_games("Planned games", [(plan.cid, plan.team1, plan.team2) for plan in plans])
+            st.rerun()
 
 
-def render_player_stats(players_db):
-    st.header("🏆 Player Statistics")
-    if not players_db:
-        st.info("No player data available yet.")
-        return
+@st.fragment(run_every=COURT_POLL_SECONDS)
+@instrumented
+def render_court_card(cid_str):
+    live_state, players_db = get_live_state(), get_players_db()
+    game = live_state.get('active_games', {}).get(cid_str)
+    st.markdown(f"<h4>Court {cid_str}</h4>", unsafe_allow_html=True)
+    if game:
+        render_active_game(cid_str, game, players_db)
+    else:
+        render_free_court(cid_str, live_state, players_db)
 
+
+@st.cache_data(max_entries=4)
+def get_leaderboard(session_id, games_logged, roster_size, _players_db):
+    # Stats only change when a game is logged or someone joins, so the frame is keyed on that
+    pd = lazy_import("pandas")
     player_data = []
-    for pid, p in players_db.items():
+    for pid, p in _players_db.items():
         games = p.get('games_played', 0)
         wins = p.get('wins', 0)
         win_rate = (wins / games * 100) if games > 0 else 0
         player_data.append({
             "Name": p['name'],
+            "Rating": round(ratings.rating(p)),
             "Games Played": games,
             "Wins": wins,
             "Win Rate (%)": f"{win_rate:.1f}"
         })
 
-    st.subheader("Leaderboard")
     df = pd.DataFrame(player_data)
     # Ensure Win Rate is numeric for sorting
     df['Win Rate (%)'] = pd.to_numeric(df['Win Rate (%)'])
-    df = df.sort_values(by="Win Rate (%)", ascending=False).reset_index(drop=True)
+    # Ratings are maintained by "Log Score & Finish"; a lucky first game doesn't top the table
+    return df.sort_values(by=["Rating", "Games Played"], ascending=False).reset_index(drop=True)
+
+
+@st.fragment(run_every=STATS_POLL_SECONDS)
+@instrumented
+def render_player_stats():
+    pd = lazy_import("pandas")
+    live_state, players_db = get_live_state(), get_players_db()
+    st.header("🏆 Player Statistics")
+    if not players_db:
+        st.info("No player data available yet.")
+        return
+
+    st.subheader("Leaderboard")
+    df = get_leaderboard(live_state.get('session_id'), live_state.get('games_logged', 0), len(players_db), players_db)
     st.dataframe(df, use_container_width=True, hide_index=True)
 
 
     st.subheader("🤝 Partnership Stats")
-    log_docs = LOG_COLLECTION_REF.stream()
-    wins = defaultdict(int)
-    played = defaultdict(int)
-    for doc in log_docs:
-        log = doc.to_dict()
-        t1_names = sorted(log.get('Team 1 Players', '').split(' & '))
-        t2_names = sorted(log.get('Team 2 Players', '').split(' & '))
-        if len(t1_names) == 2:
-            pair = tuple(t1_names)
-            played[pair] += 1
-            if log.get('Winner') == 'Team 1': wins[pair] += 1
-        if len(t2_names) == 2:
-            pair = tuple(t2_names)
-            played[pair] += 1
-            if log.get('Winner') == 'Team 2': wins[pair] += 1
+    pair_stats, matchup_stats = get_partnership_stats(REFS.session_path, live_state.get('session_id'), live_state.get('games_logged', 0))
 
     partnership_data = []
-    for pair, count in played.items():
-        win_count = wins[pair]
+    for pair in pair_stats:
+        count, win_count = pair.get('played', 0), pair.get('wins', 0)
         win_rate = (win_count / count * 100) if count > 0 else 0
         if count > 0: # Only show pairs that have played
             partnership_data.append({
-                "Partners": f"{pair[0]} & {pair[1]}",
+                "Partners": pair.get('partners', ''),
                 "Games Together": count,
                 "Wins": win_count,
                 "Partnership Win Rate (%)": f"{win_rate:.1f}"
@@ -366,36 +799,182 @@ def render_player_stats(players_db):
     else:
         st.info("No partnership data yet. Play some games!")
 
+    st.subheader("⚔️ Head-to-Head")
+    matchup_data = [{
+        "Pair A": m.get('pair_a', ''), "Pair B": m.get('pair_b', ''), "Games": m.get('played', 0),
+        "A Wins": m.get('wins_a', 0), "B Wins": m.get('wins_b', 0), "Draws": m.get('draws', 0)
+    } for m in matchup_stats if m.get('played', 0) > 0]
+    if matchup_data:
+        df_matchups = pd.DataFrame(matchup_data).sort_values(by="Games", ascending=False)
+        st.dataframe(df_matchups, use_container_width=True, hide_index=True)
+    else:
+        st.info("No head-to-head data yet.")
+
+
+# --- Season ---
+# Past nights come from the Parquet archive written on reset, never from the store. The
+# archive only changes on reset, so the loaded season and every view are keyed on its manifest.
+@st.cache_resource(max_entries=2)
+def get_season(archive_dir, session_prefix, manifest_stamp):
+    return lazy_import("analytics").Season.load(archive_dir, session_prefix)
+
+
+@st.cache_data(max_entries=32)
+def get_season_view(view, session_prefix, manifest_stamp, *args):
+    return getattr(get_season(ARCHIVE_DIR, session_prefix, manifest_stamp), view)(*args)
 
+
+@instrumented
+def render_season_view():
+    st.header("📅 Season")
+    # A club's season covers all of its venues
+    prefix, stamp = f"clubs/{CLUB_ID}/" if CLUB_ID else REFS.session_path, lazy_import("archive").manifest_stamp(ARCHIVE_DIR)
+    season = get_season(ARCHIVE_DIR, prefix, stamp)
+    if not season.games:
+        st.info("No archived sessions yet. Each night is archived when the session is reset.")
+        return
+    st.caption(f"{season.games} games archived, {season.first:%d %b %Y} to {season.last:%d %b %Y}.")
+    names = {pid: p.get('name', pid) for pid, p in get_players_db().items()}
+    today = datetime.datetime.now(CLUB_TZ).date()
+    year_start = datetime.date(today.year, 1, 1)
+
+    st.subheader("📈 Form")
+    weeks = st.slider("Weeks", 4, 26, 8, key="season_form_weeks")
+    form = get_season_view('form', prefix, stamp, weeks, today)
+    form = form[form['games'] > 0].sort_values('overall', ascending=False)
+    # Each table can be empty on its own (e.g. in January), and an empty frame's columns
+    # lose their dtypes, so every one is checked before it's formatted
+    if form.empty:
+        st.info(f"No games in the last {weeks} weeks.")
+    else:
+        week_cols = [c for c in form.columns if c not in ('games', 'overall')]
+        form[week_cols + ['overall']] = (form[week_cols + ['overall']] * 100).round(1)
+        form = form.rename(index=names, columns={**{c: f"{c:%d %b}" for c in week_cols}, 'games': "Games", 'overall': "Win Rate (%)"})
+        st.dataframe(form, use_container_width=True)
+
+    st.subheader(f"🏅 {today.year} Leaders")
+    leaders = get_season_view('leaders', prefix, stamp, year_start, 5)
+    if leaders.empty:
+        st.info(f"Nobody has played 5 games in {today.year} yet.")
+    else:
+        leaders['win_rate'] = (leaders['win_rate'] * 100).round(1)
+        st.dataframe(leaders.rename(index=names).rename(columns={'games': "Games", 'wins': "Wins", 'win_rate': "Win Rate (%)", 'point_diff': "Avg Point Diff"}).round(2),
+                     use_container_width=True)
+
+    st.subheader(f"🤝 Best Partners {today.year}")
+    partners = get_season_view('best_partners', prefix, stamp, year_start, 3).reset_index()
+    if partners.empty:
+        st.info(f"No partnership has played 3 games together in {today.year} yet.")
+    else:
+        partners['win_rate'] = (partners['win_rate'] * 100).round(1)
+        label = lambda column: partners[column].map(names).fillna(partners[column]).astype(str)
+        partners.insert(0, "Partners", label('player') + " & " + label('partner'))
+        st.dataframe(partners.drop(columns=['player', 'partner']).rename(columns={'games': "Games Together", 'wins': "Wins", 'win_rate': "Win Rate (%)"}),
+                     use_container_width=True, hide_index=True)
+
+    st.subheader("⚔️ Head-to-Head")
+    played = get_season_view('leaders', prefix, stamp, None, 1).index
+    player = st.selectbox("Player", sorted(played, key=lambda pid: names.get(pid, pid).lower()), format_func=lambda pid: names.get(pid, pid), key="season_h2h_player")
+    if player:
+        record = get_season_view('head_to_head', prefix, stamp, player)
+        if record.empty: st.info("No archived games against anyone yet.")
+        else: st.dataframe(record.rename(index=names).rename(columns=str.title), use_container_width=True)
+
+
+LOG_COLUMNS = ['Finish Time', 'Duration', 'Court', 'Team 1 Players', 'Team 2 Players', 'Score', 'Winner']
+
+# Pages of the game log, cached by cursor. Games older than a cursor never change, so
+# a cached page stays valid for the whole session; only the newest page needs topping
+# up, and only with games logged after the newest one we already hold.
+class GameLogPager:
+    def __init__(self, log_ref, max_pages=16):
+        self._log_ref = log_ref
+        self._lock = threading.Lock()
+        self.max_pages = max_pages
+        self._reset(None)
+
+    def _reset(self, session_id):
+        self.session_id, self.synced_count = session_id, None
+        self.head = []  # (finish_time, row), newest first
+        self.pages = OrderedDict()  # cursor -> ([(finish_time, row)], has_older)
+
+    @staticmethod
+    def _row(doc):
+        log = doc.to_dict()
+        finish_time = log.get('finish_time')
+        row = {col: log.get(col, '') for col in LOG_COLUMNS[1:]}
+        row['Finish Time'] = finish_time.astimezone(CLUB_TZ).strftime('%H:%M:%S') if finish_time else ''
+        return finish_time, row
+
+    def _query(self):
+        return self._log_ref.order_by("finish_time", direction=storage.DESCENDING)
+
+    def newest(self, session_id, games_logged):
+        with self._lock:
+            if session_id != self.session_id: self._reset(session_id)
+            if self.synced_count != games_logged:
+                query = self._query()
+                if self.head: query = query.where("finish_time", ">", self.head[0][0])
+                fresh = [self._row(doc) for doc in query.limit(LOG_PAGE_SIZE + 1).stream()]
+                self.head = (fresh + self.head)[:LOG_PAGE_SIZE + 1]
+                self.synced_count = games_logged
+            return self.head[:LOG_PAGE_SIZE], len(self.head) > LOG_PAGE_SIZE
+
+    def older_than(self, cursor):
+        with self._lock:
+            if cursor in self.pages:
+                self.pages.move_to_end(cursor)
+                rows, has_older = self.pages[cursor]
+                return rows, has_older
+        query = self._query().start_after({"finish_time": cursor}).limit(LOG_PAGE_SIZE + 1)
+        fetched = [self._row(doc) for doc in query.stream()]
+        rows, has_older = fetched[:LOG_PAGE_SIZE], len(fetched) > LOG_PAGE_SIZE
+        with self._lock:
+            self.pages[cursor] = (rows, has_older)
+            while len(self.pages) > self.max_pages: self.pages.popitem(last=False)
+        return rows, has_older
+
+
+@st.cache_resource
+def get_game_log_pager(session_path):
+    return GameLogPager(LOG_COLLECTION_REF)
+
+
+@st.fragment(run_every=STATS_POLL_SECONDS)
+@instrumented
 def render_game_log():
+    pd = lazy_import("pandas")
+    live_state = get_live_state()
     st.header("Completed Games Log")
-    log_docs = LOG_COLLECTION_REF.order_by("finish_time", direction=firestore.Query.DESCENDING).stream()
-    log_data = [doc.to_dict() for doc in log_docs]
-    if not log_data: st.info("No games logged yet.")
+    if 'log_cursors' not in st.session_state: st.session_state.log_cursors = []
+    pager = get_game_log_pager(REFS.session_path)
+    cursors = st.session_state.log_cursors
+    if cursors: rows, has_older = pager.older_than(cursors[-1])
+    else: rows, has_older = pager.newest(live_state.get('session_id'), live_state.get('games_logged', 0))
+
+    if not rows and not cursors: st.info("No games logged yet.")
     else:
-        df = pd.DataFrame(log_data)
-        df['finish_time'] = pd.to_datetime(df['finish_time']).dt.tz_convert('Europe/London').dt.strftime('%H:%M:%S')
-        df.rename(columns={'finish_time': 'Finish Time'}, inplace=True)
-        df = df[['Finish Time', 'Duration', 'Court', 'Team 1 Players', 'Team 2 Players', 'Score', 'Winner']]
-        st.dataframe(df, use_container_width=True, hide_index=True)
+        st.dataframe(pd.DataFrame([row for _, row in rows], columns=LOG_COLUMNS), use_container_width=True, hide_index=True)
+        nav_cols = st.columns(3)
+        if nav_cols[0].button("⬅️ Newer", disabled=not cursors, use_container_width=True):
+            cursors.pop(); st.rerun(scope="fragment")
+        nav_cols[1].caption(f"Page {len(cursors) + 1}")
+        if nav_cols[2].button("Older ➡️", disabled=not has_older, use_container_width=True):
+            cursors.append(rows[-1][0]); st.rerun(scope="fragment")
 
 
+@instrumented
 def render_checkout_view(live_state, players_db):
     st.header("Player Check-out")
-    present_pids = live_state.get('attendees', [])
-    present_players = get_players_from_ids(present_pids, players_db)
-    if not present_players:
+    present_pids = [pid for pid in live_state.get('attendees', []) if pid in players_db]
+    if not present_pids:
         st.info("No players are currently checked in.")
     else:
-        names_to_check_out = st.multiselect("Select players to check out", [p['name'] for p in present_players if p])
-        if st.button("Check Out Selected Players", disabled=not names_to_check_out):
-            pids_to_remove = [pid for pid, p in players_db.items() if p and p['name'] in names_to_check_out]
-            SESSION_DOC_REF.update({
-                'attendees': firestore.ArrayRemove(pids_to_remove),
-                'finishers_queue': firestore.ArrayRemove(pids_to_remove),
-                'main_queue': firestore.ArrayRemove(pids_to_remove)
-            })
-            st.toast(f"Checked out {', '.join(names_to_check_out)}.", icon="👋"); st.rerun()
+        pids_to_check_out = player_picker("Select players to check out", present_pids, "check_out_pick")
+        if st.button("Check Out Selected Players", disabled=not pids_to_check_out):
+            queue_write("Check-out", lambda state, pids: club.check_out(REFS, pids, state), pids_to_check_out,
+                        club.preview_check_out, key="check_out")
+            st.toast(f"Checked out {', '.join(get_player_index().names_for(pids_to_check_out))}.", icon="👋"); st.rerun()
 
 
 # --- Court View Components ---
@@ -405,66 +984,50 @@ def render_active_game(cid_str, game, players_db):
     st.markdown(f"**Team 1:** {' & '.join([p['name'] for p in team1_players if p])}")
     st.markdown(f"**Team 2:** {' & '.join([p['name'] for p in team2_players if p])}")
 
-    start_time = game.get('start_time')
-    if isinstance(start_time, str): start_time = datetime.datetime.fromisoformat(start_time).replace(tzinfo=timezone.utc)
-    elif isinstance(start_time, datetime.datetime) and start_time.tzinfo is None: start_time = start_time.replace(tzinfo=timezone.utc)
-    
-    if not start_time: start_time = datetime.datetime.now(timezone.utc)
-
-    elapsed = datetime.datetime.now(timezone.utc) - start_time
-    st.metric("Time Elapsed", f"{int(elapsed.total_seconds() // 60):02d}:{int(elapsed.total_seconds() % 60):02d}")
-
+    render_elapsed_time(cid_str, club.parse_start_time(game.get('start_time')))
 
     s_cols = st.columns(2)
     t1s, t2s = s_cols[0].number_input("T1 Score", 0, 30, step=1, key=f"t1s_{cid_str}"), s_cols[1].number_input("T2 Score", 0, 30, step=1, key=f"t2s_{cid_str}")
 
     if st.button("Log Score & Finish", key=f"log_{cid_str}", use_container_width=True, type="primary"):
-        # Determine winners and losers
-        winning_pids = team1_pids if t1s > t2s else team2_pids
-        losing_pids = team2_pids if t1s > t2s else team1_pids
-        is_draw = t1s == t2s
-        if is_draw: winning_pids, losing_pids = [], team1_pids + team2_pids
-
-        # Order winners by chooser count for fairness
-        winners = get_players_from_ids(winning_pids, players_db)
-        if len(winners) == 2:
-            p1_id = next(pid for pid, p in players_db.items() if p['name'] == winners[0]['name'])
-            p2_id = next(pid for pid, p in players_db.items() if p['name'] == winners[1]['name'])
-            p1_count = winners[0].get('chooser_count', 0)
-            p2_count = winners[1].get('chooser_count', 0)
-            ordered_winners = [p1_id, p2_id] if p1_count <= p2_count else [p2_id, p1_id]
-        else:
-             ordered_winners = winning_pids
+        index = get_player_index()
+        def run(state, finishes):
+            (cid, player_ids, t1, t2), = finishes
+            # The court may have been finished and restarted by another device meanwhile
+            if (state.get('active_games', {}).get(cid) or {}).get('player_ids') != player_ids:
+                raise club.StaleAction(f"Court {cid} has already been finished.")
+            return club.finish_game(REFS, index, state, cid, t1, t2)
+        # Only the four players' counters change, so patch them into the shared roster
+        queue_write(f"Court {cid_str} result", run, [(cid_str, game.get('player_ids'), t1s, t2s)],
+                    club.preview_finish_game, on_success=get_roster().apply)
+        st.rerun()
 
-        new_finishers = ordered_winners + losing_pids
 
-        # Update session state
-        live_state['active_games'].pop(cid_str)
-        SESSION_DOC_REF.update({
-            'active_games': live_state['active_games'],
-            'finishers_queue': firestore.ArrayUnion(new_finishers)
-        })
-
-        # Update player profiles (stats)
-        batch = db.batch()
-        for pid in winning_pids:
-            ref = PLAYERS_COLLECTION_REF.document(str(pid))
-            batch.update(ref, {'games_played': firestore.Increment(1), 'wins': firestore.Increment(1)})
-        for pid in losing_pids:
-            ref = PLAYERS_COLLECTION_REF.document(str(pid))
-            batch.update(ref, {'games_played': firestore.Increment(1)})
-        if ordered_winners:
-            chooser_ref = PLAYERS_COLLECTION_REF.document(str(ordered_winners[0]))
-            batch.update(chooser_ref, {'chooser_count': firestore.Increment(1)})
-        batch.commit()
-
-        # Log the game
-        log = {'finish_time': firestore.SERVER_TIMESTAMP, 'Duration': f"{int(elapsed.total_seconds() // 60)}m", 'Court': cid_str,
-               'Team 1 Players': " & ".join([p['name'] for p in team1_players if p]), 'Team 2 Players': " & ".join([p['name'] for p in team2_players if p]),
-               'Score': f"{t1s} - {t2s}", 'Winner': "Draw" if is_draw else "Team 1" if t1s > t2s else "Team 2"}
-        LOG_COLLECTION_REF.add(log)
-        st.cache_data.clear()  # Clear cache to refetch player stats
-        st.rerun()
+ELAPSED_TIMER_HTML = """
+<div>
+  <div style="font-size: 14px;">Time Elapsed</div>
+  <div id="%(timer_id)s" style="font-size: 2.25rem; line-height: 1.4;">--:--</div>
+</div>
+<script>
+  (() => {
+    const id = "%(timer_id)s", started = %(start_ms)d, timers = window.courtTimers = window.courtTimers || {};
+    const pad = n => String(n).padStart(2, "0");
+    const tick = () => {
+      const el = document.getElementById(id);
+      if (!el) { clearInterval(timers[id]); delete timers[id]; return; }
+      const s = Math.max(0, Math.floor((Date.now() - started) / 1000));
+      el.textContent = pad(Math.floor(s / 60)) + ":" + pad(s %% 60);
+    };
+    clearInterval(timers[id]); timers[id] = setInterval(tick, 1000); tick();
+  })();
+</script>
+"""
+
+def render_elapsed_time(cid_str, start_time):
+    # Ticks in the browser; the markup only depends on the court and start time, so
+    # card reruns don't touch it and the server never reruns just to move the clock
+    start_ms = int(start_time.timestamp() * 1000)
+    st.html(ELAPSED_TIMER_HTML % {'timer_id': f"elapsed-{cid_str}-{start_ms}", 'start_ms': start_ms}, unsafe_allow_javascript=True)
 
 
 def render_free_court(cid_str, live_state, players_db):
@@ -480,77 +1043,87 @@ def render_free_court(cid_str, live_state, players_db):
 
         available_pids = waiting_pids[1:]
 
-        # Initialize session state for dnd lists if not present
-        dnd_keys = [f'game_players_{cid_str}', f'team1_{cid_str}', f'team2_{cid_str}', f'unassigned_{cid_str}']
-        for key in dnd_keys:
-            if key not in st.session_state:
-                st.session_state[key] = []
+        # One-tap suggestions from the matchmaker; dragging names stays as the fallback
+        index = get_player_index()
+        recent = get_recent_games(REFS.session_path, live_state.get('session_id'), live_state.get('games_logged', 0))
+        st.markdown("<h5>⚡ Suggested Games</h5>", unsafe_allow_html=True)
+        for n, suggestion in enumerate(lazy_import("matchmaking").suggest(waiting_pids, players_db, recent)):
+            label = f"{' & '.join(index.names_for(suggestion.team1))}  vs  {' & '.join(index.names_for(suggestion.team2))}"
+            if st.button(label, key=f"suggest_{cid_str}_{n}", use_container_width=True, type="primary" if n == 0 else "secondary"):
+                start_court(cid_str, live_state, suggestion.team1, suggestion.team2)
+
+        with st.expander("✋ Pick Teams Manually"):
+            st_dnd = lazy_import("streamlit_dnd").st_dnd  # Drag-and-Drop functionality
+            # Initialize session state for dnd lists if not present
+            dnd_keys = [f'game_players_{cid_str}', f'team1_{cid_str}', f'team2_{cid_str}', f'unassigned_{cid_str}']
+            for key in dnd_keys:
+                if key not in st.session_state:
+                    st.session_state[key] = []
         
-        # --- Drag and Drop UI ---
-        # Box to select the 3 other players
-        st.markdown("<h5>1. Available Players (Drag 3 to the box below)</h5>", unsafe_allow_html=True)
-        available_list = [p['name'] for p in get_players_from_ids(available_pids, players_db) if p['name'] not in st.session_state[f'game_players_{cid_str}']]
-        game_players_box = st_dnd(id=f'dnd_select_{cid_str}', items=available_list, box_style="dnd-container")
+            # --- Drag and Drop UI ---
+            # Box to select the 3 other players
+            st.markdown("<h5>1. Available Players (Drag 3 to the box below)</h5>", unsafe_allow_html=True)
+            available_list = [p['name'] for p in get_players_from_ids(available_pids, players_db) if p['name'] not in st.session_state[f'game_players_{cid_str}']]
+            game_players_box = st_dnd(id=f'dnd_select_{cid_str}', items=available_list, box_style="dnd-container")
         
-        # Update session state when 3 players are selected
-        if game_players_box is not None and len(game_players_box) == 3:
-            st.session_state[f'game_players_{cid_str}'] = game_players_box
-            all_four_players = [chooser_player['name']] + game_players_box
-            st.session_state[f'unassigned_{cid_str}'] = all_four_players
-            st.rerun() # Rerun to move to team selection phase
+            # Update session state when 3 players are selected
+            if game_players_box is not None and len(game_players_box) == 3:
+                st.session_state[f'game_players_{cid_str}'] = game_players_box
+                all_four_players = [chooser_player['name']] + game_players_box
+                st.session_state[f'unassigned_{cid_str}'] = all_four_players
+                st.rerun() # Rerun to move to team selection phase
         
-        # Once 3 players are chosen, show team selection boxes
-        if len(st.session_state[f'game_players_{cid_str}']) == 3:
-            st.markdown("---")
-            st.markdown(f"**Game Players:** {chooser_player['name']}, {', '.join(st.session_state[f'game_players_{cid_str}'])}")
+            # Once 3 players are chosen, show team selection boxes
+            if len(st.session_state[f'game_players_{cid_str}']) == 3:
+                st.markdown("---")
+                st.markdown(f"**Game Players:** {chooser_player['name']}, {', '.join(st.session_state[f'game_players_{cid_str}'])}")
             
-            st.markdown("<h5>2. Unassigned (Drag to teams)</h5>", unsafe_allow_html=True)
-            unassigned_result = st_dnd(id=f'dnd_unassigned_{cid_str}', items=st.session_state[f'unassigned_{cid_str}'], box_style="dnd-container")
-
-            t1_col, t2_col = st.columns(2)
-            with t1_col:
-                st.markdown("<h5>Team 1</h5>", unsafe_allow_html=True)
-                team1_result = st_dnd(id=f'dnd_t1_{cid_str}', items=st.session_state[f'team1_{cid_str}'], box_style="dnd-container")
-            with t2_col:
-                st.markdown("<h5>Team 2</h5>", unsafe_allow_html=True)
-                team2_result = st_dnd(id=f'dnd_t2_{cid_str}', items=st.session_state[f'team2_{cid_str}'], box_style="dnd-container")
+                st.markdown("<h5>2. Unassigned (Drag to teams)</h5>", unsafe_allow_html=True)
+                unassigned_result = st_dnd(id=f'dnd_unassigned_{cid_str}', items=st.session_state[f'unassigned_{cid_str}'], box_style="dnd-container")
+
+                t1_col, t2_col = st.columns(2)
+                with t1_col:
+                    st.markdown("<h5>Team 1</h5>", unsafe_allow_html=True)
+                    team1_result = st_dnd(id=f'dnd_t1_{cid_str}', items=st.session_state[f'team1_{cid_str}'], box_style="dnd-container")
+                with t2_col:
+                    st.markdown("<h5>Team 2</h5>", unsafe_allow_html=True)
+                    team2_result = st_dnd(id=f'dnd_t2_{cid_str}', items=st.session_state[f'team2_{cid_str}'], box_style="dnd-container")
             
-            # Sync state after any DND operation
-            if (st.session_state[f'unassigned_{cid_str}'] != unassigned_result or
-                st.session_state[f'team1_{cid_str}'] != team1_result or
-                st.session_state[f'team2_{cid_str}'] != team2_result):
+                # Sync state after any DND operation
+                if (st.session_state[f'unassigned_{cid_str}'] != unassigned_result or
+                    st.session_state[f'team1_{cid_str}'] != team1_result or
+                    st.session_state[f'team2_{cid_str}'] != team2_result):
                 
-                st.session_state[f'unassigned_{cid_str}'] = unassigned_result
-                st.session_state[f'team1_{cid_str}'] = team1_result
-                st.session_state[f'team2_{cid_str}'] = team2_result
-                st.rerun()
-
-            if len(team1_result) == 2 and len(team2_result) == 2:
-                if st.button("Start Game", key=f"start_dnd_{cid_str}", use_container_width=True, type="primary"):
-                    team1_pids = [pid for pid, p in players_db.items() if p['name'] in team1_result]
-                    team2_pids = [pid for pid, p in players_db.items() if p['name'] in team2_result]
-                    all_pids = team1_pids + team2_pids
-                    
-                    live_state['active_games'][cid_str] = {
-                        'team1_pids': team1_pids,
-                        'team2_pids': team2_pids,
-                        'player_ids': all_pids,
-                        'start_time': firestore.SERVER_TIMESTAMP
-                    }
-                    
-                    SESSION_DOC_REF.update({
-                        'finishers_queue': firestore.ArrayRemove(all_pids),
-                        'main_queue': firestore.ArrayRemove(all_pids),
-                        'active_games': live_state['active_games']
-                    })
-                    
-                    # Clear dnd state for this court and rerun
-                    for key in dnd_keys:
-                        if key in st.session_state: del st.session_state[key]
+                    st.session_state[f'unassigned_{cid_str}'] = unassigned_result
+                    st.session_state[f'team1_{cid_str}'] = team1_result
+                    st.session_state[f'team2_{cid_str}'] = team2_result
                     st.rerun()
 
+                if len(team1_result) == 2 and len(team2_result) == 2:
+                    if st.button("Start Game", key=f"start_dnd_{cid_str}", use_container_width=True, type="primary"):
+                        index = get_player_index()
+                        start_court(cid_str, live_state, index.pids_for(team1_result), index.pids_for(team2_result))
+
+
+def queue_games(label, games):
+    # games: [(cid, team1_pids, team2_pids)], started together in one session write
+    run = lambda state, games: club.start_games(REFS, state, {cid: (t1, t2) for cid, t1, t2 in games})
+    queue_write(label, run, games, club.preview_start_games)
+
+
+def start_court(cid_str, live_state, team1_pids, team2_pids):
+    queue_games(f"Court {cid_str}", [(cid_str, team1_pids, team2_pids)])
+
+    # Clear dnd state for this court and rerun
+    for key in [f'game_players_{cid_str}', f'team1_{cid_str}', f'team2_{cid_str}', f'unassigned_{cid_str}']:
+        if key in st.session_state: del st.session_state[key]
+    st.rerun()
 
-def render_queue_view(live_state, players_db):
+
+@st.fragment(run_every=QUEUE_POLL_SECONDS)
+@instrumented
+def render_queue_view():
+    live_state, players_db = get_live_state(), get_players_db()
     st.header("⏳ Waiting Queue")
     st.caption("Finishers move to the top, winners first.")
     waiting_pids = live_state.get('finishers_queue', []) + live_state.get('main_queue', [])
@@ -568,23 +1141,37 @@ def render_queue_view(live_state, players_db):
     if st.session_state.court_operator_logged_in in ADMIN_USERS:
         with st.expander("### Remove Player from Queue"):
             if waiting_players:
-                names_to_remove = st.multiselect("Select players to remove", [p['name'] for p in waiting_players if p])
-                if st.button("Remove Selected", disabled=not names_to_remove):
-                    pids_to_remove = [pid for pid, p in players_db.items() if p and p['name'] in names_to_remove]
-                    SESSION_DOC_REF.update({
-                        'finishers_queue': firestore.ArrayRemove(pids_to_remove),
-                        'main_queue': firestore.ArrayRemove(pids_to_remove)
-                    })
-                    st.toast(f"Removed {', '.join(names_to_remove)}.", icon="👋"); st.rerun()
+                pids_to_remove = player_picker("Select players to remove", [pid for pid in waiting_pids if pid in players_db], "remove_pick")
+                if st.button("Remove Selected", disabled=not pids_to_remove):
+                    queue_write("Queue removal", lambda state, pids: club.remove_from_queue(REFS, pids, state), pids_to_remove,
+                                club.preview_remove_from_queue, key="remove_from_queue")
+                    st.toast(f"Removed {', '.join(get_player_index().names_for(pids_to_remove))}.", icon="👋"); st.rerun()
             else:
                 st.write("Queue is empty.")
 
 
+@st.cache_resource
+def get_process_profile():
+    return {}
+
+
+def render_startup_profile(run_ms):
+    # `?profile=startup`: what this server process paid for lazy imports, and run times
+    profile = get_process_profile()
+    imports = [row for row in metrics.REGISTRY.snapshot()['operations'] if row['op'].startswith("import ")]
+    heavy = ["pandas", "numpy", "pyarrow", "firebase_admin", "google.cloud.firestore", "extra_streamlit_components", "streamlit_dnd"]
+    with st.expander("⏱️ Startup Profile", expanded=True):
+        st.markdown(f"**This run:** {run_ms:.0f} ms · **First run in this process:** {profile['first_run_ms']:.0f} ms ({profile['first_run_mode']})")
+        if imports:
+            st.markdown("\n".join(["| Import | Cost (ms) |", "|---|---|"] + [f"| {row['op'][7:]} | {row['mean_ms']} |" for row in imports]))
+        st.caption("Loaded in this process: " + (", ".join(m for m in heavy if m in sys.modules) or "none of the heavy modules"))
+
+
 # ────────────────────────────────────────────────────────────────────────────────
 # MAIN APP EXECUTION
 # ────────────────────────────────────────────────────────────────────────────────
 if not db:
-    st.error("Could not connect to Firebase.")
+    st.error("Could not connect to the database.")
 else:
     if 'court_operator_logged_in' not in st.session_state: st.session_state.court_operator_logged_in = None
     if 'player_logged_in_name' not in st.session_state: st.session_state.player_logged_in_name = None
@@ -598,11 +1185,15 @@ else:
 
     st.session_state.logout_in_progress = False
 
-    live_state = get_live_state()
-    players_db = get_players_db()
+    show_write_failures()
 
     mode = st.query_params.get("mode")
     if mode == "court":
-        render_court_mode(live_state, players_db, cookie_manager)
+        render_court_mode(get_live_state(), get_players_db(), cookie_manager)
     else:
-        render_player_mode(live_state, players_db, cookie_manager)
+        render_player_mode(cookie_manager)
+
+    run_ms = (time.perf_counter() - SCRIPT_STARTED) * 1000
+    get_process_profile().setdefault('first_run_ms', run_ms)
+    get_process_profile().setdefault('first_run_mode', CLIENT_MODE)
+    if st.query_params.get("profile") == "startup": render_startup_profile(run_ms)
@@ -0,0 +1,230 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# CLUB NIGHT BENCHMARK
+# ────────────────────────────────────────────────────────────────────────────────
+# Simulates a full club night against the local store: a synthetic roster checks in,
+# courts cycle through games, players drift off near the end. Court tablets and
+# player phones rerun the real app (via Streamlit's AppTest) whenever the shared
+# state changes, exactly as the version-gated refresh does in production.
+#
+#   python bench.py --preset club
+#   python bench.py --players 2000 --courts 12 --hours 3 --tablets 4 --phones 20
+#
+# Results are written to bench_results/ and compared with the previous run of the
+# same scenario, so regressions show up between versions.
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import club
+import storage
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "badminton.py")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+ADMIN_NAME = "Bench Admin"
+REGRESSION_THRESHOLD = 1.2  # Flag metrics that got 20% worse than the previous run
+
+PRESETS = {
+    'small': dict(players=50, courts=4, hours=1.0, tablets=2, phones=5),
+    'club': dict(players=300, courts=8, hours=3.0, tablets=4, phones=20),
+    'large': dict(players=5000, courts=20, hours=3.0, tablets=8, phones=40),
+}
+FIRST_NAMES = ["Alex", "Sam", "Priya", "Chen", "Jo", "Maria", "Omar", "Kate", "Ravi", "Lena", "Tom", "Aisha", "Ben", "Yuki", "Noah", "Zara"]
+LAST_NAMES = ["Smith", "Patel", "Wong", "Brown", "Garcia", "Khan", "Jones", "Taylor", "Singh", "Evans", "Lee", "Murphy", "Ali", "Clark"]
+
+
+def percentiles(samples):
+    if not samples: return {'n': 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'n': len(ordered), 'mean_ms': round(statistics.fmean(ordered), 2), 'p50_ms': round(pick(0.50), 2),
+            'p90_ms': round(pick(0.90), 2), 'p99_ms': round(pick(0.99), 2), 'max_ms': round(ordered[-1], 2)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(APP_PATH)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def seed_roster(refs, players, rng):
+    # Unique names, written in chunked batches like a real import would do
+    names = set()
+    while len(names) < players:
+        names.add(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {len(names)}")
+    names = [ADMIN_NAME] + sorted(names)[:players - 1]
+    roster = {}
+    for name in names:
+        pid, player = club.new_player(name)
+        player.update(skill=rng.randint(1, 5), games_played=rng.randint(0, 200))
+        player['wins'] = rng.randint(0, player['games_played'])
+        roster[pid] = player
+    club.commit_in_batches(refs, (('set', refs.players.document(pid), player) for pid, player in roster.items()))
+    return roster
+
+
+class Client:
+    # One browser session of the app: a court tablet or a player phone
+    def __init__(self, mode, secrets, operator=None, player_name=None):
+        self.mode = mode
+        self.app = AppTest.from_file(APP_PATH, default_timeout=60)
+        self.app.secrets["app_secrets"] = secrets
+        if mode == "court":
+            self.app.query_params["mode"] = "court"
+            self.app.session_state["court_operator_logged_in"] = operator
+        else:
+            self.app.session_state["player_logged_in_name"] = player_name
+
+    def run(self):
+        self.app.run()
+        if self.app.exception: raise RuntimeError(f"{self.mode} rerun failed: {self.app.exception[0].value}")
+
+
+class ClubNight:
+    def __init__(self, players, courts, hours, tablets, phones, seed=7):
+        self.courts, self.hours = courts, hours
+        self.rng = random.Random(seed)
+        self.db_path = os.path.join(tempfile.mkdtemp(prefix="badminton-bench-"), "club.db")
+        self.store = storage.LocalStore.open(self.db_path)
+        self.refs = club.SessionRefs(self.store)
+        self.refs.session.set(club.default_session_state())
+        self.roster = seed_roster(self.refs, players, self.rng)
+        self.index = club.load_player_index(self.refs)
+        # Like the app, so harness writes pay for (and phones see) the public queue view
+        self.refs.names, self.refs.courts = self.index.names_for, [str(i + 1) for i in range(courts)]
+        secrets = {"admin_password": "bench", "admin_users": [ADMIN_NAME], "storage_backend": "local",
+                   "local_db_path": self.db_path, "max_courts": courts}
+        self.attendance = min(players, courts * 6)
+        self.arrivals = self.rng.sample(sorted(self.roster), self.attendance)
+        phone_names = [self.roster[pid]['name'] for pid in self.arrivals[:phones]]
+        self.clients = [Client("court", secrets, operator=ADMIN_NAME) for _ in range(tablets)]
+        self.clients += [Client("player", secrets, player_name=name) for name in phone_names]
+        self.game_ends = {}  # court id -> simulated minute the game ends
+        self.render_ms = defaultdict(list)
+        self.mutation_ms = defaultdict(list)
+        self.counted_reads = self.counted_writes = 0
+        self.games = 0
+
+    def measured(self, samples, fn, *args):
+        reads, writes = self.store.reads, self.store.writes
+        started = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+        self.counted_reads += self.store.reads - reads
+        self.counted_writes += self.store.writes - writes
+
+    def live_state(self):
+        # The harness's own view of the state; deliberately outside the counted windows
+        return club.load_live_state(self.refs)
+
+    def step(self, minute):
+        changed = False
+        # Arrivals trickle in over the first half hour
+        if minute < 30:
+            for pid in self.arrivals[self.attendance * minute // 30:self.attendance * (minute + 1) // 30]:
+                self.measured(self.mutation_ms['check_in'], club.check_in, self.refs, self.live_state(), pid)
+                changed = True
+
+        # Finish games that have run their course, then fill free courts
+        for cid, ends in list(self.game_ends.items()):
+            if minute >= ends:
+                t1s, t2s = (21, self.rng.randint(5, 19)) if self.rng.random() < 0.5 else (self.rng.randint(5, 19), 21)
+                self.measured(self.mutation_ms['finish_game'], club.finish_game, self.refs, self.index, self.live_state(), cid, t1s, t2s)
+                del self.game_ends[cid]; self.games += 1; changed = True
+        for i in range(self.courts):
+            cid, state = str(i + 1), self.live_state()
+            waiting = club.waiting_pids(state)
+            if cid in state['active_games'] or len(waiting) < 4: continue
+            chooser, picks = waiting[0], self.rng.sample(waiting[1:8], 3)
+            self.measured(self.mutation_ms['start_game'], club.start_game, self.refs, state, cid, [chooser, picks[0]], picks[1:])
+            self.game_ends[cid] = minute + self.rng.randint(10, 20); changed = True
+
+        # A few players leave during the last hour
+        if minute > (self.hours - 1) * 60 and self.rng.random() < 0.2:
+            waiting = club.waiting_pids(self.live_state())
+            if len(waiting) > 8:
+                self.measured(self.mutation_ms['check_out'], club.check_out, self.refs, [self.rng.choice(waiting[4:])])
+                changed = True
+        return changed
+
+    def run(self):
+        started = time.perf_counter()
+        for client in self.clients: self.measured(self.render_ms[f"{client.mode}_first"], client.run)
+        minutes = int(self.hours * 60)
+        for minute in range(minutes):
+            # Clients only rerun when the shared state moved, like rerun_on_state_change
+            if self.step(minute):
+                for client in self.clients: self.measured(self.render_ms[client.mode], client.run)
+        return {
+            'games': self.games,
+            'simulated_minutes': minutes,
+            'wall_seconds': round(time.perf_counter() - started, 2),
+            'render': {mode: percentiles(samples) for mode, samples in self.render_ms.items()},
+            'mutations': {op: percentiles(samples) for op, samples in self.mutation_ms.items()},
+            'reads_per_minute': round(self.counted_reads / minutes, 1),
+            'writes_per_minute': round(self.counted_writes / minutes, 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def compare_with_previous(scenario, result):
+    previous = sorted(f for f in os.listdir(RESULTS_DIR) if f.startswith(scenario + "-")) if os.path.isdir(RESULTS_DIR) else []
+    if not previous: return []
+    with open(os.path.join(RESULTS_DIR, previous[-1])) as f: baseline = json.load(f)
+    regressions = []
+    for section in ('render', 'mutations'):
+        for name, stats in result[section].items():
+            old = baseline.get(section, {}).get(name, {}).get('p90_ms')
+            if old and stats.get('p90_ms', 0) > old * REGRESSION_THRESHOLD:
+                regressions.append(f"{section}.{name} p90 {old}ms -> {stats['p90_ms']}ms")
+    for metric in ('reads_per_minute', 'writes_per_minute', 'peak_rss_mb'):
+        old = baseline.get(metric)
+        if old and result[metric] > old * REGRESSION_THRESHOLD:
+            regressions.append(f"{metric} {old} -> {result[metric]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a club night and measure rerun cost.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--players", type=int); parser.add_argument("--courts", type=int)
+    parser.add_argument("--hours", type=float); parser.add_argument("--tablets", type=int)
+    parser.add_argument("--phones", type=int); parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-save", action="store_true", help="Print results without writing bench_results/")
+    args = parser.parse_args(argv)
+
+    config = dict(PRESETS[args.preset])
+    config.update({k: v for k, v in vars(args).items() if k in config and v is not None})
+    scenario = "p{players}-c{courts}-h{hours:g}-t{tablets}-f{phones}".format(**config)
+
+    st.cache_data.clear(); st.cache_resource.clear()
+    result = ClubNight(seed=args.seed, **config).run()
+    result.update(scenario=scenario, config=config, revision=git_revision(),
+                  recorded_at=datetime.datetime.now(datetime.timezone.utc).isoformat(), python=sys.version.split()[0])
+    print(json.dumps(result, indent=2))
+
+    regressions = compare_with_previous(scenario, result)
+    for line in regressions: print(f"REGRESSION: {line}", file=sys.stderr)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        with open(os.path.join(RESULTS_DIR, f"{scenario}-{stamp}.json"), "w") as f: json.dump(result, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,730 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# CLUB NIGHT LOGIC
+# ────────────────────────────────────────────────────────────────────────────────
+# Everything that reads or mutates the roster and the live session, kept free of
+# Streamlit so the app, the benchmark harness and offline tools share one code path.
+
+import datetime
+import heapq
+import random
+import csv
+import io
+import re
+import string
+import threading
+import time
+from collections import defaultdict
+from datetime import timezone
+from typing import List, Optional, NamedTuple
+
+import ratings
+import storage
+
+
+class SessionRefs:
+    def __init__(self, store, session_path="session/live_state", players_path="players"):
+        self.store = store
+        self.session_path, self.players_path = session_path, players_path
+        self.players = store.collection(players_path)
+        self.session = store.document(session_path)
+        self.log = self.session.collection("game_log")
+        self.pair_stats = self.session.collection("pair_stats")
+        self.matchup_stats = self.session.collection("matchup_stats")
+        self.events = self.session.collection("events")
+        self.snapshots = self.session.collection("snapshots")
+        self.queue_view = self.session.collection("public").document("queue")
+        self.names = None  # pids -> display names; set by the app so writes can keep queue_view current
+        self.courts = ()  # Court ids in play, for the wait estimates in queue_view
+
+    def stats_collection(self, name):
+        return {'pair_stats': self.pair_stats, 'matchup_stats': self.matchup_stats}[name]
+
+
+# --- Clubs & Venues ---
+# Each club/venue pair runs its own live-state document (with its own log and stats
+# underneath), so halls never contend on one document's write rate. The roster is either
+# shared by every club or kept per club.
+def slug(value) -> Optional[str]:
+    value = re.sub(r'[^a-z0-9]+', '-', (value or '').strip().lower()).strip('-')[:40]
+    return value or None
+
+def session_paths(club_id=None, venue=None, roster_scope="shared"):
+    # No club: the original single session, so existing deployments keep their data
+    if not club_id: return "session/live_state", "players"
+    players_path = f"clubs/{club_id}/players" if roster_scope == "club" else "players"
+    return f"clubs/{club_id}/venues/{venue or 'main'}", players_path
+
+
+def generate_password(): return "".join(random.choices(string.digits, k=6))
+
+def default_session_state():
+    return {
+        'attendees': [], 'finishers_queue': [], 'main_queue': [], 'active_games': {},
+        'session_password': generate_password(), 'last_chooser_id': None,
+        'session_id': "".join(random.choices(string.ascii_letters + string.digits, k=12)), 'games_logged': 0,
+        'event_seq': 0, 'duration_stats': {}
+    }
+
+# Listener copies of the session carry the document's update_time under this key, so
+# court mutations can use it as a write precondition without an extra read
+UPDATE_TIME_KEY = '_update_time'
+MAX_WRITE_ATTEMPTS = 5
+
+
+# The action no longer applies, e.g. another tablet already started or finished the court
+class StaleAction(Exception):
+    pass
+
+
+def load_live_state(refs):
+    doc = refs.session.get()
+    state = doc.to_dict() if doc.exists else default_session_state()
+    # Ensure queue keys exist
+    state.setdefault('finishers_queue', []); state.setdefault('main_queue', []); state.setdefault('active_games', {})
+    state[UPDATE_TIME_KEY] = doc.update_time
+    return state
+
+
+def commit_session_change(refs, live_state, build):
+    # Optimistic concurrency: `build(state, batch)` validates against the state, stages
+    # any side writes and returns the session event (kind, data) to apply. The session
+    # update only applies if nobody else wrote since that state; otherwise re-read and try again.
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        if live_state is None or live_state.get(UPDATE_TIME_KEY) is None: live_state = load_live_state(refs)
+        batch = refs.store.batch()
+        kind, data = build(live_state, batch)
+        seq = live_state.get('event_seq', 0) + 1
+        updates = {**session_updates(kind, data), 'event_seq': seq}
+        batch.update(refs.session, updates, last_update_time=live_state[UPDATE_TIME_KEY])
+        after = storage.apply_update(live_state, updates)
+        record_event(refs, batch, seq, kind, data, after)
+        stage_queue_view(refs, batch, live_state, after)
+        try:
+            return batch.commit()
+        except storage.Conflict:
+            live_state = None
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+    raise StaleAction("The session is busy right now. Please try again.")
+
+
+# Bulk writes (imports, rebuilds, resets) go out as plain batches of at most BATCH_LIMIT
+# ops, each a (method, *args) tuple for a write batch, e.g. ('set', ref, data, True)
+BATCH_LIMIT = 500  # Firestore's cap on writes per batch
+
+def commit_in_batches(refs, ops):
+    ops = list(ops)
+    for start in range(0, len(ops), BATCH_LIMIT):
+        batch = refs.store.batch()
+        for method, *args in ops[start:start + BATCH_LIMIT]: getattr(batch, method)(*args)
+        batch.commit()
+    return len(ops)
+
+
+def waiting_pids(live_state) -> List[str]:
+    return live_state.get('finishers_queue', []) + live_state.get('main_queue', [])
+
+
+# --- Session Events ---
+# Every session write is also appended to <session>/events as a compact event: its kind
+# and just the data needed to redo it, numbered by the session's `event_seq`. The live
+# write and a replay both turn the event into the document update with session_updates(),
+# so they can't drift apart. Every SNAPSHOT_EVERY events the resulting state is saved to
+# <session>/snapshots, so any point of the night rebuilds from the nearest snapshot plus
+# the events after it. A reset saves snapshot 0, the state the night started from.
+SNAPSHOT_EVERY = 100
+
+def session_updates(kind, data, now=storage.SERVER_TIMESTAMP):
+    if kind == 'check_in':
+        return {'attendees': storage.ArrayUnion(data['pids']), 'main_queue': storage.ArrayUnion(data['pids'])}
+    if kind in ('check_out', 'remove_from_queue'):
+        updates = {'finishers_queue': storage.ArrayRemove(data['pids']), 'main_queue': storage.ArrayRemove(data['pids'])}
+        if kind == 'check_out': updates['attendees'] = storage.ArrayRemove(data['pids'])
+        return updates
+    if kind == 'start':
+        # data['games']: {court id: {'team1': pids, 'team2': pids}}; Firestore can't nest arrays
+        all_pids = [pid for game in data['games'].values() for pid in game['team1'] + game['team2']]
+        # Only these courts' entries are written, so tablets on other courts never clobber each other
+        return {
+            'finishers_queue': storage.ArrayRemove(all_pids),
+            'main_queue': storage.ArrayRemove(all_pids),
+            **{f'active_games.{cid}': {'team1_pids': game['team1'], 'team2_pids': game['team2'],
+                                       'player_ids': game['team1'] + game['team2'], 'start_time': now}
+               for cid, game in data['games'].items()}
+        }
+    if kind == 'finish':
+        return {
+            f"active_games.{data['court']}": storage.DELETE_FIELD,
+            'finishers_queue': storage.ArrayUnion(data['finishers']),
+            'games_logged': storage.Increment(1),
+            **(duration_updates(data['court'], data['hour'], data['minutes']) if 'minutes' in data else {})
+        }
+    if kind == 'games_logged':
+        return {'games_logged': data['games']}
+    raise ValueError(f"Unknown session event: {kind}")
+
+def event_id(seq): return f"{seq:09d}"  # Zero-padded so ids sort in event order
+
+def snapshot_state(state):
+    return {k: v for k, v in state.items() if k != UPDATE_TIME_KEY}
+
+def record_event(refs, batch, seq, kind, data, after):
+    batch.set(refs.events.document(event_id(seq)), {'seq': seq, 'kind': kind, 'data': data, 'at': storage.SERVER_TIMESTAMP,
+                                                    'session_id': after.get('session_id')})
+    if seq % SNAPSHOT_EVERY == 0:
+        batch.set(refs.snapshots.document(event_id(seq)), {'seq': seq, 'state': snapshot_state(after)})
+
+def apply_event(state, event):
+    # Pure: the state after `event` (an events doc), with start times taken from the event
+    return storage.apply_update(state, {**session_updates(event['kind'], event['data'], now=event.get('at')), 'event_seq': event['seq']})
+
+def session_events(refs, after_seq=0, upto=None, session_id=None):
+    # With `session_id`, only that night's events; ids restart each night, so a straggler
+    # from the night before can't be replayed into this one
+    query = refs.events.where('seq', '>', after_seq)
+    if upto is not None: query = query.where('seq', '<=', upto)
+    docs = list(query.order_by('seq').stream())
+    return docs if session_id is None else [doc for doc in docs if doc.to_dict().get('session_id') == session_id]
+
+def rebuild_state(refs, upto=None):
+    # The session as it was after event `upto` (default: the latest event), reading one
+    # snapshot and only the events since it
+    query = refs.snapshots.order_by('seq', direction=storage.DESCENDING)
+    if upto is not None: query = query.where('seq', '<=', upto)
+    snapshot = next(iter(query.limit(1).stream()), None)
+    if snapshot is None: raise LookupError("No snapshot to rebuild from; the session predates event logging.")
+    snapshot = snapshot.to_dict()
+    state = snapshot['state']
+    for doc in session_events(refs, snapshot['seq'], upto, state.get('session_id')): state = apply_event(state, doc.to_dict())
+    return state
+
+
+# --- Public Queue View ---
+# A small denormalised doc (session/public/queue) with just the waiting names in order
+# and a version, so player phones can follow the queue without the session document or
+# the roster. It rides in the same batch as the session write that moved the queue, and
+# that write's precondition keeps the two in step.
+# Each write also computes everyone's estimated time on court (queue_etas) once, so
+# phones only subtract the clock.
+def queue_view(state, names, courts=()):
+    return {'session_id': state.get('session_id'), 'waiting': names(waiting_pids(state)),
+            'eta': queue_etas(state, courts), 'version': storage.Increment(1)}
+
+def stage_queue_view(refs, batch, before, after):
+    if refs.names is None: return
+    if waiting_pids(after) == waiting_pids(before) and after.get('session_id') == before.get('session_id'): return
+    batch.set(refs.queue_view, queue_view(after, refs.names, refs.courts), merge=True)
+
+def publish_queue_view(refs, live_state=None):
+    # Full rewrite, e.g. for a session that predates the view
+    if refs.names is None: return
+    refs.queue_view.set(queue_view(live_state or load_live_state(refs), refs.names, refs.courts), merge=True)
+
+
+# --- Wait Estimates ---
+# Every finish adds its length to running totals per court and per hour (the UTC hour the
+# game started) in the session doc: a handful of Increments, so O(1) per game, and they
+# replay like the rest of the event. A court's expected game length leans on the hour's
+# mean until it has a few games of its own, and the hour's on the night's.
+DEFAULT_GAME_MINUTES = 12
+PRIOR_GAMES = 3  # Games' worth of weight the broader mean carries
+MIN_REMAINING_MINUTES = 1  # An overrunning game is taken to be about to finish; no game is shorter
+ETA_HORIZON = datetime.timedelta(hours=3)  # Waits longer than this aren't estimated
+
+def duration_updates(court, hour, minutes):
+    return {f'duration_stats.{scope}.{key}': storage.Increment(value)
+            for scope in (f'court.{court}', f'hour.{hour}', 'all') for key, value in (('games', 1), ('minutes', minutes))}
+
+def expected_minutes(stats, court, hour):
+    shrink = lambda totals, prior: (totals.get('minutes', 0) + PRIOR_GAMES * prior) / (totals.get('games', 0) + PRIOR_GAMES)
+    night = shrink(stats.get('all', {}), DEFAULT_GAME_MINUTES)
+    return shrink(stats.get('court', {}).get(str(court), {}), shrink(stats.get('hour', {}).get(str(hour), {}), night))
+
+def queue_etas(state, courts=(), now=None):
+    # When each waiting player should be on court, in waiting order (None past ETA_HORIZON).
+    # Plays the night forward the way courts get filled: whichever court frees first takes
+    # the four at the head of finishers_queue + main_queue, and the four it lets off rejoin
+    # finishers_queue, ahead of everyone still in main_queue.
+    now = now or datetime.datetime.now(timezone.utc)
+    stats, active = state.get('duration_stats', {}), state.get('active_games', {})
+    minutes = lambda cid, start: max(MIN_REMAINING_MINUTES, expected_minutes(stats, cid, start.astimezone(timezone.utc).hour))
+    length = lambda cid, start: datetime.timedelta(minutes=minutes(cid, start))
+    finishers, main = list(state.get('finishers_queue', [])), list(state.get('main_queue', []))
+    etas = dict.fromkeys(finishers + main)
+    courts_free = []  # (time, idle, court id, players it lets off); at equal times busy courts go first
+    for cid in dict.fromkeys([*map(str, courts), *active]):
+        game = active.get(cid)
+        if game is None: courts_free.append((now, 1, cid, [])); continue
+        start = parse_start_time(game.get('start_time'), now)
+        ends = max(start + length(cid, start), now + datetime.timedelta(minutes=MIN_REMAINING_MINUTES))
+        courts_free.append((ends, 0, cid, list(game.get('player_ids', []))))
+    heapq.heapify(courts_free)
+    unplaced = len(etas)
+    while courts_free and unplaced and courts_free[0][0] - now <= ETA_HORIZON:
+        at, _, cid, released = heapq.heappop(courts_free)
+        finishers += [pid for pid in released if pid not in finishers]
+        game = (finishers + main)[:4]
+        if len(game) < 4:
+            # Not enough players: the court waits for the next one to come off
+            if not any(players for *_, players in courts_free): break
+            heapq.heappush(courts_free, (min(t for t, *_, players in courts_free if players), 1, cid, [])); continue
+        finishers, main = [pid for pid in finishers if pid not in game], [pid for pid in main if pid not in game]
+        for pid in game:
+            if pid in etas and etas[pid] is None: etas[pid] = at; unplaced -= 1
+        heapq.heappush(courts_free, (at + length(cid, at), 0, cid, game))
+    return [etas[pid] for pid in waiting_pids(state)]
+
+def parse_start_time(start_time, now=None):
+    if isinstance(start_time, str): start_time = datetime.datetime.fromisoformat(start_time).replace(tzinfo=timezone.utc)
+    elif isinstance(start_time, datetime.datetime) and start_time.tzinfo is None: start_time = start_time.replace(tzinfo=timezone.utc)
+    return start_time or now or datetime.datetime.now(timezone.utc)
+
+
+# --- Roster Index ---
+class PlayerRecord(NamedTuple):
+    name: str
+    chooser_count: int
+    games_played: int
+    wins: int
+    rating: float
+
+    @classmethod
+    def from_doc(cls, p):
+        return cls(p.get('name', ''), p.get('chooser_count', 0), p.get('games_played', 0), p.get('wins', 0), ratings.rating(p))
+
+
+# --- Name Search ---
+# Trigram index over roster names for "did you mean" matches: a typo like "Jon Smith"
+# still shares most of its trigrams with "John Smith". Each word is padded on its own, so
+# grams also mark where words start and end. Scores are counted for every name at once
+# from the posting lists of the query's grams: the Dice coefficient of the two gram sets
+# for a whole name typed at login, or with `partial` the share of the query's grams the
+# name holds, so a surname or part of a name ("Shah") finds the full one. A whole name
+# also has to come close on every word typed: sharing just a first name or a surname
+# with someone ("Ben Smith" and "Alex Smith") isn't a near miss. A name holding
+# all of the query's grams but the word endings most likely starts its words with the
+# query (someone typing "Pri" for "Priya"), and is lifted towards 1. numpy is imported on
+# first use so player phones that never search don't pay for it.
+NGRAM = 3
+MIN_NAME_SCORE = 0.45
+PREFIX_BONUS = 0.5  # Share of the remaining distance to 1 a prefix match gains
+MIN_WORD_SHARE = 1 / 3  # Of each typed word's grams a whole-name match must hold
+
+def normalise_name(name): return " ".join(re.sub(r'[\W_]+', ' ', (name or '').casefold()).split())
+
+def name_grams(normalised):
+    # In order, per word; a gram ending in the pad closes a word
+    padded = [f"  {word} " for word in normalised.split()]
+    return list(dict.fromkeys(word[i:i + NGRAM] for word in padded for i in range(len(word) - NGRAM + 1)))
+
+class NameIndex:
+    def __init__(self, names):
+        # names: {pid: display name}
+        import numpy as np
+        self.pids = list(names)
+        self.position = {pid: i for i, pid in enumerate(self.pids)}
+        postings, sizes = defaultdict(list), []
+        for i, pid in enumerate(self.pids):
+            grams = name_grams(normalise_name(names[pid]))
+            sizes.append(len(grams))
+            for gram in grams: postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.sizes = np.array(sizes, dtype=float)
+
+    def search(self, query, limit=5, within=None, min_score=MIN_NAME_SCORE, partial=False):
+        # Best matches first as [(pid, score)]; `within` limits the result to those pids
+        import numpy as np
+        grams = name_grams(normalise_name(query))
+        if not self.pids or len(grams) < 2: return []
+        count = lambda found: np.bincount(np.concatenate(found), minlength=len(self.pids)) if found else np.zeros(len(self.pids), dtype=np.int64)
+        head = [g for g in grams if not g.endswith(' ')]
+        shared_head = count([self.postings[g] for g in head if g in self.postings])
+        shared = shared_head + count([self.postings[g] for g in grams if g.endswith(' ') and g in self.postings])
+        if not shared.any(): return []
+        dice = 2.0 * shared / (len(grams) + self.sizes)
+        score = shared / len(grams) if partial else dice
+        score = np.where(shared_head == len(head), score + PREFIX_BONUS * (1.0 - score), score)
+        if not partial:
+            for word in normalise_name(query).split():
+                word_grams = name_grams(word)
+                found = count([self.postings[g] for g in word_grams if g in self.postings])
+                score = np.where(found >= MIN_WORD_SHARE * len(word_grams), score, 0.0)
+        if within is not None:
+            allowed = np.zeros(len(self.pids), dtype=bool)
+            allowed[[self.position[pid] for pid in within if pid in self.position]] = True
+            score[~allowed] = 0.0
+        candidates = np.flatnonzero(score >= min_score)
+        best = candidates[np.lexsort((-dice[candidates], -score[candidates]))[:limit]]  # Ties go to the closer whole name
+        return [(self.pids[i], round(float(score[i]), 3)) for i in best]
+
+
+# Name <-> id lookups over the roster without scanning players_db on every rerun.
+# Entries are replaced rather than mutated so readers in other sessions never see a
+# dict change size under them.
+class PlayerIndex:
+    def __init__(self, players_db):
+        self.players = dict(players_db)
+        self.by_name = {p.get('name', '').casefold(): pid for pid, p in players_db.items()}
+        self.by_id = {pid: PlayerRecord.from_doc(p) for pid, p in players_db.items()}
+        self._names = None  # NameIndex, built on the first search
+
+    def add(self, pid, player):
+        self.add_many({pid: player})
+
+    def add_many(self, players):
+        self.players = {**self.players, **players}
+        self.by_name = {**self.by_name, **{p.get('name', '').casefold(): pid for pid, p in players.items()}}
+        self.by_id = {**self.by_id, **{pid: PlayerRecord.from_doc(p) for pid, p in players.items()}}
+        self._names = None
+
+    def apply(self, increments):
+        # increments: {pid: {field: delta}}, e.g. the counters a finished game bumped
+        players = dict(self.players)
+        for pid, changes in increments.items():
+            if pid not in players: continue
+            players[pid] = {**players[pid], **{k: players[pid].get(k, 0) + v for k, v in changes.items()}}
+        self.players = players
+        self.by_id = {**self.by_id, **{pid: PlayerRecord.from_doc(players[pid]) for pid in increments if pid in players}}
+
+    def pid_for(self, name) -> Optional[str]:
+        return self.by_name.get(name.casefold())
+
+    def pids_for(self, names) -> List[str]:
+        return [pid for pid in (self.pid_for(n) for n in names) if pid]
+
+    def record(self, pid) -> Optional[PlayerRecord]:
+        return self.by_id.get(pid)
+
+    def names_for(self, pids) -> List[str]:
+        return [r.name for r in (self.record(pid) for pid in pids) if r]
+
+    def search(self, query, limit=5, within=None, partial=False):
+        names = self._names
+        if names is None: self._names = names = NameIndex({pid: r.name for pid, r in self.by_id.items()})
+        return names.search(query, limit, within, partial=partial)
+
+
+def load_player_index(refs):
+    return PlayerIndex({doc.id: doc.to_dict() for doc in refs.players.stream()})
+
+
+ROSTER_REFRESH_SECONDS = 300
+
+# Process-wide roster for one players collection. Our own writes (new profiles, finished
+# games) are applied as deltas, so nothing re-streams the roster after them. A full
+# re-stream only happens every ROSTER_REFRESH_SECONDS to pick up writes from elsewhere,
+# done by one caller while every other session keeps reading the current copy.
+class RosterCache:
+    def __init__(self, refs, refresh_seconds=ROSTER_REFRESH_SECONDS):
+        self._refs, self.refresh_seconds = refs, refresh_seconds
+        self._lock = threading.Lock()     # Guards index/version
+        self._loading = threading.Lock()  # Single flight for re-streams
+        self.index, self.version, self.loaded_at = None, 0, 0.0
+
+    def get(self) -> PlayerIndex:
+        if self.index is None:
+            with self._loading:
+                if self.index is None: self._reload()
+        elif time.monotonic() - self.loaded_at > self.refresh_seconds and self._loading.acquire(blocking=False):
+            try: self._reload()
+            finally: self._loading.release()
+        return self.index
+
+    def _reload(self):
+        started = self.version
+        index = load_player_index(self._refs)
+        with self._lock:
+            # A delta landed mid-stream and may be missing from it; keep ours and retry later
+            if self.index is not None and self.version != started: return
+            self.index, self.loaded_at = index, time.monotonic()
+            self.version += 1
+
+    def add(self, pid, player):
+        self.add_many({pid: player})
+
+    def add_many(self, players):
+        index = self.get()
+        with self._lock:
+            index.add_many(players); self.version += 1
+
+    def apply(self, increments):
+        with self._lock:
+            if self.index is None: return
+            self.index.apply(increments); self.version += 1
+
+    def invalidate(self):
+        # Re-stream on the next read, e.g. after a bulk rewrite like a ratings rebuild
+        self.loaded_at = 0.0
+
+
+def new_player(name):
+    return storage.new_doc_id(), {
+        'name': name,
+        'gender': "Men",  # Default or ask
+        'skill': 2,
+        'chooser_count': 0,
+        'games_played': 0,
+        'wins': 0,
+        'rating_points': 0.0
+    }
+
+
+def create_player(refs, name):
+    pid, player = new_player(name)
+    refs.players.document(pid).set(player)
+    return pid, player
+
+
+def create_players(refs, names):
+    # Bulk import: {pid: player} for the new profiles, written in chunked batches
+    created = dict(new_player(name) for name in dict.fromkeys(names))
+    commit_in_batches(refs, (('set', refs.players.document(pid), player) for pid, player in created.items()))
+    return created
+
+
+CSV_NAME_HEADERS = {'name', 'player', 'member'}
+
+def names_from_csv(text):
+    # (column title, names) from an uploaded roster. The first row is always the header;
+    # names come from the column titled like "Name" / "Player name", else the first one.
+    # Title-cased like the login form does.
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if not rows: return None, []
+    header = [cell.strip() for cell in rows[0]]
+    column = next((i for i, title in enumerate(header) if CSV_NAME_HEADERS & set(normalise_name(title).split())), 0)
+    names = (row[column].strip().title() for row in rows[1:] if len(row) > column and row[column].strip())
+    return header[column], list(dict.fromkeys(names))
+
+
+# --- Partnership & Head-to-Head Aggregates ---
+# "Log Score & Finish" increments these in the same batch as the player stats, so the
+# Stats tab reads O(pairs) documents instead of re-tallying the whole game_log.
+def pair_key(pids): return "_".join(sorted(pids))
+
+def game_stat_deltas(team1_pids, team2_pids, team1_names, team2_names, winner):
+    # Returns {(collection_name, doc_id): (fixed_fields, counter_increments)}
+    if len(team1_pids) != 2 or len(team2_pids) != 2: return {}
+    deltas = {}
+    teams = [(pair_key(team1_pids), " & ".join(sorted(team1_names)), winner == "Team 1"),
+             (pair_key(team2_pids), " & ".join(sorted(team2_names)), winner == "Team 2")]
+    for key, names, won in teams:
+        deltas[('pair_stats', key)] = ({'partners': names}, {'played': 1, 'wins': int(won)})
+    (a_key, a_names, a_won), (b_key, b_names, b_won) = sorted(teams)
+    deltas[('matchup_stats', f"{a_key}__{b_key}")] = (
+        {'pair_a': a_names, 'pair_b': b_names},
+        {'played': 1, 'wins_a': int(a_won), 'wins_b': int(b_won), 'draws': int(winner == "Draw")})
+    return deltas
+
+def add_stat_increments(refs, batch, deltas):
+    for (coll_name, doc_id), (fields, counters) in deltas.items():
+        ref = refs.stats_collection(coll_name).document(doc_id)
+        batch.set(ref, {**fields, **{k: storage.Increment(v) for k, v in counters.items()}}, merge=True)
+
+def recent_games(refs, limit=20):
+    # (team1_pids, team2_pids) of the latest logged games, newest first
+    query = refs.log.order_by("finish_time", direction=storage.DESCENDING).limit(limit)
+    games = [doc.to_dict() for doc in query.stream()]
+    return [(g['team1_pids'], g['team2_pids']) for g in games if g.get('team1_pids') and g.get('team2_pids')]
+
+def rebuild_partnership_stats(refs, index):
+    # One-off backfill of the aggregates from whatever is already in the game log
+    totals, games = {}, 0
+    for doc in refs.log.stream():
+        log = doc.to_dict(); games += 1
+        t1_names = [n for n in log.get('Team 1 Players', '').split(' & ') if n]
+        t2_names = [n for n in log.get('Team 2 Players', '').split(' & ') if n]
+        t1_pids = log.get('team1_pids') or index.pids_for(t1_names)
+        t2_pids = log.get('team2_pids') or index.pids_for(t2_names)
+        for key, (fields, counters) in game_stat_deltas(t1_pids, t2_pids, t1_names, t2_names, log.get('Winner')).items():
+            _, summed = totals.setdefault(key, (fields, defaultdict(int)))
+            for k, v in counters.items(): summed[k] += v
+    delete_documents(refs, [doc.reference for coll_ref in (refs.pair_stats, refs.matchup_stats) for doc in coll_ref.stream()])
+    rebuilt = commit_in_batches(refs, (('set', refs.stats_collection(coll_name).document(doc_id), {**fields, **counters})
+                                       for (coll_name, doc_id), (fields, counters) in totals.items()))
+    commit_session_change(refs, None, lambda state, batch: ('games_logged', {'games': games}))
+    return rebuilt
+
+def rebuild_ratings(refs, history=(), k=ratings.K_FACTOR):
+    # Replays every game (e.g. after changing K_FACTOR): `history`, the earlier nights as
+    # ratings.replay() input (see archive.rating_games), then tonight's log. Only players
+    # who appear in them are rewritten; they restart from RATING_BASE.
+    logs = [doc.to_dict() for doc in refs.log.order_by("finish_time").stream()]
+    rebuilt = ratings.replay(list(history) + ratings.log_games(logs), k=k)
+    return commit_in_batches(refs, (('set', refs.players.document(pid), {'rating_points': value - ratings.RATING_BASE}, True)
+                                    for pid, value in rebuilt.items()))
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# SESSION MUTATIONS
+# ────────────────────────────────────────────────────────────────────────────────
+def check_in(refs, live_state, pid):
+    return bool(check_in_many(refs, live_state, [pid]))
+
+
+def check_in_many(refs, live_state, pids):
+    # Returns the players that weren't already here
+    new_pids = []
+
+    def build(state, batch):
+        present = set(state.get('attendees', []))
+        new_pids[:] = [pid for pid in dict.fromkeys(pids) if pid not in present]
+        return 'check_in', {'pids': list(new_pids)}
+    if all(pid in live_state.get('attendees', []) for pid in pids): return []
+    commit_session_change(refs, live_state, build)
+    return new_pids
+
+
+# Queue changes go through commit_session_change (rather than blind array updates) so the
+# public queue view is written from the exact state they applied to
+def check_out(refs, pids, live_state=None):
+    commit_session_change(refs, live_state, lambda state, batch: ('check_out', {'pids': list(pids)}))
+
+
+def remove_from_queue(refs, pids, live_state=None):
+    commit_session_change(refs, live_state, lambda state, batch: ('remove_from_queue', {'pids': list(pids)}))
+
+
+def start_game(refs, live_state, cid, team1_pids, team2_pids):
+    start_games(refs, live_state, {cid: (team1_pids, team2_pids)})
+
+
+def start_games(refs, live_state, games):
+    # games: {court id: (team1_pids, team2_pids)}, all started in one session write
+    entries = {cid: {'team1': list(team1_pids), 'team2': list(team2_pids)} for cid, (team1_pids, team2_pids) in games.items()}
+    all_pids = [pid for game in entries.values() for pid in game['team1'] + game['team2']]
+
+    def build(state, batch):
+        for cid in entries:
+            if cid in state.get('active_games', {}): raise StaleAction(f"Court {cid} has already been started.")
+        if not set(all_pids) <= set(waiting_pids(state)): raise StaleAction("Some of these players are no longer waiting.")
+        return 'start', {'games': entries}
+    commit_session_change(refs, live_state, build)
+
+
+def finish_game(refs, index, live_state, cid, t1s, t2s, now=None):
+    expected = live_state['active_games'].get(cid)
+    if not expected: raise StaleAction(f"Court {cid} has already been finished.")
+    now = now or datetime.datetime.now(timezone.utc)
+
+    def build(state, batch):
+        game = state.get('active_games', {}).get(cid)
+        if not game or game.get('player_ids') != expected.get('player_ids'):
+            raise StaleAction(f"Court {cid} has already been finished.")
+        team1_pids = game.get('team1_pids', []); team2_pids = game.get('team2_pids', [])
+        elapsed = now - parse_start_time(game.get('start_time'), now)
+
+        # Determine winners and losers
+        winning_pids = team1_pids if t1s > t2s else team2_pids
+        losing_pids = team2_pids if t1s > t2s else team1_pids
+        is_draw = t1s == t2s
+        if is_draw: winning_pids, losing_pids = [], team1_pids + team2_pids
+
+        # Order winners by chooser count for fairness
+        winners = [index.record(pid) for pid in winning_pids]
+        if len(winners) == 2 and all(winners):
+            p1_id, p2_id = winning_pids
+            p1_count = winners[0].chooser_count
+            p2_count = winners[1].chooser_count
+            ordered_winners = [p1_id, p2_id] if p1_count <= p2_count else [p2_id, p1_id]
+        else:
+            ordered_winners = winning_pids
+
+        new_finishers = ordered_winners + losing_pids
+        winner = "Draw" if is_draw else "Team 1" if t1s > t2s else "Team 2"
+        team1_names, team2_names = index.names_for(team1_pids), index.names_for(team2_pids)
+        rating_changes = {}
+        if len(team1_pids) == 2 and len(team2_pids) == 2:
+            current = lambda pids: [r.rating if r else ratings.RATING_BASE for r in map(index.record, pids)]
+            t1_change, t2_change = ratings.game_changes(current(team1_pids), current(team2_pids), winner)
+            rating_changes = {**dict.fromkeys(team1_pids, t1_change), **dict.fromkeys(team2_pids, t2_change)}
+
+        # Court release, queue, stats, aggregates and log entry all land in one commit:
+        # a single round trip, and a crash can't leave the queue and stats out of step
+        increments.clear()
+        for pid in winning_pids:
+            increments[pid] = {'games_played': 1, 'wins': 1, 'rating_points': rating_changes.get(pid, 0.0)}
+        for pid in losing_pids:
+            increments[pid] = {'games_played': 1, 'rating_points': rating_changes.get(pid, 0.0)}
+        if ordered_winners:
+            increments[ordered_winners[0]]['chooser_count'] = 1
+        for pid, changes in increments.items():
+            batch.update(refs.players.document(str(pid)), {k: storage.Increment(v) for k, v in changes.items()})
+        add_stat_increments(refs, batch, game_stat_deltas(team1_pids, team2_pids, team1_names, team2_names, winner))
+        log = {'finish_time': storage.SERVER_TIMESTAMP, 'Duration': f"{int(elapsed.total_seconds() // 60)}m", 'Court': cid,
+               'Team 1 Players': " & ".join(team1_names), 'Team 2 Players': " & ".join(team2_names),
+               'Score': f"{t1s} - {t2s}", 'Winner': winner, 'team1_pids': team1_pids, 'team2_pids': team2_pids}
+        batch.set(refs.log.document(), log)
+        started = parse_start_time(game.get('start_time'), now).astimezone(timezone.utc)
+        return 'finish', {'court': cid, 'score': [t1s, t2s], 'finishers': new_finishers,
+                          'minutes': round(elapsed.total_seconds() / 60, 1), 'hour': started.hour}
+    # The player counters the committed attempt bumped, for RosterCache.apply
+    increments = {}
+    commit_session_change(refs, live_state, build)
+    return increments
+
+
+# --- Optimistic Previews ---
+# Local, idempotent mirrors of the mutations above, applied to a state copy so a queued
+# write shows up before it lands (see writes.py). Applying one to a state that already
+# contains the write changes nothing.
+def _without(values, pids): return [v for v in values if v not in pids]
+
+def preview_check_in(state, pids):
+    for pid in pids:
+        if pid not in state['attendees']:
+            state['attendees'].append(pid); state['main_queue'].append(pid)
+
+def preview_check_out(state, pids):
+    state['attendees'] = _without(state['attendees'], pids)
+    preview_remove_from_queue(state, pids)
+
+def preview_remove_from_queue(state, pids):
+    state['finishers_queue'] = _without(state['finishers_queue'], pids)
+    state['main_queue'] = _without(state['main_queue'], pids)
+
+def preview_start_games(state, games):
+    # games: [(cid, team1_pids, team2_pids)]
+    for cid, team1_pids, team2_pids in games:
+        if cid in state['active_games']: continue
+        state['active_games'][cid] = {'team1_pids': team1_pids, 'team2_pids': team2_pids,
+                                      'player_ids': team1_pids + team2_pids, 'start_time': datetime.datetime.now(timezone.utc)}
+        preview_remove_from_queue(state, team1_pids + team2_pids)
+
+def preview_finish_game(state, finishes):
+    # finishes: [(cid, player_ids, t1s, t2s)]; winners first, like finish_game
+    for cid, player_ids, t1s, t2s in finishes:
+        game = state['active_games'].get(cid)
+        if not game or game.get('player_ids') != player_ids: continue
+        del state['active_games'][cid]
+        team1_pids, team2_pids = game.get('team1_pids', []), game.get('team2_pids', [])
+        finishers = team2_pids + team1_pids if t2s > t1s else team1_pids + team2_pids
+        state['finishers_queue'] += [pid for pid in finishers if pid not in state['finishers_queue']]
+
+
+def session_log(refs):
+    # The whole night's log, oldest first, e.g. to archive before a reset
+    return list(refs.log.order_by("finish_time").stream())
+
+def delete_documents(refs, doc_refs):
+    return commit_in_batches(refs, (('delete', ref) for ref in doc_refs))
+
+def start_session(refs):
+    # A fresh session document plus snapshot 0, where the night's events start from
+    state = default_session_state()
+    batch = refs.store.batch()
+    batch.set(refs.session, state)
+    batch.set(refs.snapshots.document(event_id(0)), {'seq': 0, 'state': state})
+    batch.commit()
+    return state
+
+def clear_session(refs, log_docs=None, event_docs=None):
+    # log_docs / event_docs: the snapshots if the caller has already streamed them (see
+    # session_log, session_events). The old night goes before the new one starts: event ids
+    # restart at 1, so deleting afterwards would take the new night's first events with it.
+    docs = [doc.reference for doc in (refs.log.stream() if log_docs is None else log_docs)]
+    docs += [doc.reference for doc in (refs.events.stream() if event_docs is None else event_docs)]
+    docs += [doc.reference for doc in refs.snapshots.stream()]
+    for coll_ref in (refs.pair_stats, refs.matchup_stats): docs += [doc.reference for doc in coll_ref.stream()]
+    deleted = delete_documents(refs, docs)
+    state = start_session(refs)
+    publish_queue_view(refs, state)
+    return deleted
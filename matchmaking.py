@@ -0,0 +1,94 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# MATCHMAKING
+# ────────────────────────────────────────────────────────────────────────────────
+# Suggests games for a free court. The chooser (head of the queue) is always in the
+# game; the other three come from the next players waiting. Every candidate foursome
+# and each of its three team splits is scored in one vectorised pass, lower is better.
+
+from itertools import combinations
+from typing import List, NamedTuple
+
+import numpy as np
+
+WINDOW = 12               # How far down the queue suggestions may reach
+RECENT_GAMES = 20         # Logged games looked at for repeat partners and opponents
+RATING_PER_SKILL = 200.0  # Rating points worth one skill level
+RECENT_DECAY = 0.85       # A game one game older counts this much less towards "played recently"
+WEIGHTS = {
+    'balance': 1.0,    # Strength gap between the two teams
+    'spread': 0.25,    # Gap between the strongest and weakest player on court
+    'partners': 1.5,   # Same partners as in recent games
+    'opponents': 0.5,  # Same opponents as in recent games
+    'wait': 2.0,       # Skipping over people who have waited longer
+}
+# The three ways to split a foursome into two pairs, slot 0 being the chooser
+SPLITS = np.array([[0, 1, 2, 3], [0, 2, 1, 3], [0, 3, 1, 2]])
+
+
+class Suggestion(NamedTuple):
+    team1: List[str]
+    team2: List[str]
+    score: float
+
+
+def player_strength(player):
+    # Self-reported skill level, nudged by how the rating has moved since
+    player = player or {}
+    return float(player.get('skill', 2)) + player.get('rating_points', 0.0) / RATING_PER_SKILL
+
+
+def strengths(pids, players_db):
+    return np.array([player_strength(players_db.get(pid)) for pid in pids])
+
+
+def history_matrices(pids, recent_games):
+    # partners[i, j] / opponents[i, j]: decayed count of recent games where window
+    # players i and j were on the same / opposite sides. `recent_games` is newest first.
+    pos = {pid: i for i, pid in enumerate(pids)}
+    partners, opponents = np.zeros((len(pids), len(pids))), np.zeros((len(pids), len(pids)))
+    for age, (team1, team2) in enumerate(recent_games):
+        weight = RECENT_DECAY ** age
+        t1, t2 = [pos[p] for p in team1 if p in pos], [pos[p] for p in team2 if p in pos]
+        for team in (t1, t2):
+            for i, j in combinations(team, 2): partners[i, j] += weight; partners[j, i] += weight
+        for i in t1:
+            for j in t2: opponents[i, j] += weight; opponents[j, i] += weight
+    return partners, opponents
+
+
+def split_scores(foursomes, strength, partners, opponents, weights=WEIGHTS):
+    # (M, 4) window indices -> (M, 3) cost of each split in SPLITS, queue position aside
+    games = foursomes[:, SPLITS]  # (M, 3, 4): a & b vs c & d
+    a, b, c, d = games[..., 0], games[..., 1], games[..., 2], games[..., 3]
+    on_court = strength[foursomes]
+    balance = np.abs(strength[a] + strength[b] - strength[c] - strength[d])
+    spread = (on_court.max(axis=1) - on_court.min(axis=1))[:, None]
+    partner_repeats = partners[a, b] + partners[c, d]
+    opponent_repeats = opponents[a, c] + opponents[a, d] + opponents[b, c] + opponents[b, d]
+    return (weights['balance'] * balance + weights['spread'] * spread + weights['partners'] * partner_repeats
+            + weights['opponents'] * opponent_repeats)
+
+
+def score_games(strength, partners, opponents, weights=WEIGHTS):
+    # Returns (foursomes, scores): foursomes is (C, 4) window indices with the chooser
+    # first, scores is (C, 3), one column per split in SPLITS
+    n = len(strength)
+    picks = np.array(list(combinations(range(1, n), 3)), dtype=np.intp)
+    foursomes = np.hstack([np.zeros((len(picks), 1), dtype=np.intp), picks])
+    # 0 when the next three in line play; grows with how far down the queue we reach
+    wait = ((picks.sum(axis=1) - 6) / max(n - 1, 1))[:, None]
+    return foursomes, split_scores(foursomes, strength, partners, opponents, weights) + weights['wait'] * wait
+
+
+def suggest(waiting, players_db, recent_games=(), top=3, window=WINDOW, weights=WEIGHTS) -> List[Suggestion]:
+    pids = list(waiting[:window])
+    if len(pids) < 4: return []
+    strength = strengths(pids, players_db)
+    foursomes, scores = score_games(strength, *history_matrices(pids, recent_games), weights=weights)
+    best_split, best = scores.argmin(axis=1), scores.min(axis=1)
+    order = np.argsort(best, kind='stable')[:top]
+    suggestions = []
+    for i in order:
+        a, b, c, d = foursomes[i][SPLITS[best_split[i]]]
+        suggestions.append(Suggestion([pids[a], pids[b]], [pids[c], pids[d]], round(float(best[i]), 3)))
+    return suggestions
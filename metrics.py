@@ -0,0 +1,103 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# HOT-PATH METRICS
+# ────────────────────────────────────────────────────────────────────────────────
+# Process-wide timings and store read/write counters, labelled by operation (usually a
+# render_* function) and client mode. Store I/O reaches us through storage's observer
+# hook and is charged to the innermost operation running on the calling thread; I/O
+# from listener threads is charged to "background". Timings keep a rolling window per
+# label set, so percentiles follow the recent state of the app.
+
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+WINDOW = 512  # Timing samples kept per operation and mode
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = "badminton"
+
+
+def quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.window = window
+        self.started = time.time()
+        self.timings = defaultdict(lambda: deque(maxlen=self.window))  # (op, mode) -> seconds
+        self.calls = defaultdict(int)                                   # (op, mode) -> total calls
+        self.store_io = defaultdict(int)                                # (kind, op, mode) -> documents
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'): self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def operation(self, op, mode="-"):
+        stack = self._stack()
+        stack.append((op, mode))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                self.timings[(op, mode)].append(elapsed)
+                self.calls[(op, mode)] += 1
+
+    def record_io(self, kind, count):
+        # storage observer: kind is "read" or "write", count is documents
+        stack = self._stack()
+        op, mode = stack[-1] if stack else ("background", "-")
+        with self._lock: self.store_io[(kind, op, mode)] += count
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear(); self.calls.clear(); self.store_io.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            timings = {key: sorted(samples) for key, samples in self.timings.items()}
+            calls, store_io = dict(self.calls), dict(self.store_io)
+        ops = []
+        # Includes I/O from outside any timed operation (listener threads etc.)
+        for op, mode in sorted(set(timings) | {(op, mode) for _, op, mode in store_io}):
+            row = {'op': op, 'mode': mode, 'calls': calls.get((op, mode), 0)}
+            ordered = timings.get((op, mode))
+            if ordered:
+                row['mean_ms'] = round(statistics.fmean(ordered) * 1000, 2)
+                row.update({f"p{int(q * 100)}_ms": round(quantile(ordered, q) * 1000, 2) for q in QUANTILES})
+            row.update(reads=store_io.get(('read', op, mode), 0), writes=store_io.get(('write', op, mode), 0))
+            ops.append(row)
+        return {'since': self.started, 'uptime_s': round(time.time() - self.started, 1), 'operations': ops}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        with self._lock:
+            timings = {key: sorted(samples) for key, samples in self.timings.items()}
+            calls, store_io = dict(self.calls), dict(self.store_io)
+        label = lambda op, mode, **extra: ",".join(f'{k}="{v}"' for k, v in dict(op=op, mode=mode, **extra).items())
+        lines = [f"# HELP {PREFIX}_operation_seconds Render and action durations over the last {self.window} calls.",
+                 f"# TYPE {PREFIX}_operation_seconds summary"]
+        for (op, mode), ordered in sorted(timings.items()):
+            for q in QUANTILES:
+                lines.append(f"{PREFIX}_operation_seconds{{{label(op, mode, quantile=q)}}} {quantile(ordered, q):.6f}")
+            lines.append(f"{PREFIX}_operation_seconds_count{{{label(op, mode)}}} {calls[(op, mode)]}")
+        for kind in ("read", "write"):
+            lines += [f"# HELP {PREFIX}_store_{kind}s_total Billed document {kind}s.",
+                      f"# TYPE {PREFIX}_store_{kind}s_total counter"]
+            for (k, op, mode), count in sorted(store_io.items()):
+                if k == kind: lines.append(f"{PREFIX}_store_{kind}s_total{{{label(op, mode)}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Metrics()
@@ -0,0 +1,82 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# PLAYER RATINGS
+# ────────────────────────────────────────────────────────────────────────────────
+# Doubles Elo. A team plays at the mean of its two ratings and both partners move by
+# the same amount, the other team by the opposite. Player docs store the offset from
+# RATING_BASE as `rating_points`, so a finished game can apply its change as a plain
+# Increment in the same batch as the win/loss counters, with no read of the old value.
+# numpy is only imported by the vectorised paths, so logging a single game (and every
+# player-mode page, which imports club) doesn't pay for it.
+
+from typing import Dict, Iterable, List, Tuple
+
+RATING_BASE = 1500.0
+K_FACTOR = 32.0
+SCALE = 400.0  # A team this many points stronger is expected to win ~91% of games
+
+
+def rating(player):
+    return RATING_BASE + (player or {}).get('rating_points', 0.0)
+
+
+def outcome(winner):
+    # Team 1's result: 1 win, 0 loss, 0.5 draw
+    return {"Team 1": 1.0, "Team 2": 0.0}.get(winner, 0.5)
+
+
+def team1_deltas(team1_ratings, team2_ratings, outcomes, k=K_FACTOR):
+    # Vectorised over games: (N, 2), (N, 2), (N,) -> (N,) change for each team 1 player
+    import numpy as np
+    t1, t2 = np.mean(team1_ratings, axis=-1), np.mean(team2_ratings, axis=-1)
+    expected = 1.0 / (1.0 + 10.0 ** ((t2 - t1) / SCALE))
+    return k * (np.asarray(outcomes, dtype=float) - expected)
+
+
+def game_changes(team1_ratings, team2_ratings, winner, k=K_FACTOR) -> Tuple[float, float]:
+    # (team 1 change, team 2 change) for one game; same formula as team1_deltas
+    t1, t2 = sum(team1_ratings) / len(team1_ratings), sum(team2_ratings) / len(team2_ratings)
+    delta = k * (outcome(winner) - 1.0 / (1.0 + 10.0 ** ((t2 - t1) / SCALE)))
+    return delta, -delta
+
+
+def conflict_free_layers(games):
+    # Layer of each game: one past the latest layer any of its players appeared in. Games
+    # in a layer share no players, and each player's games stay in order, so updating a
+    # whole layer at once gives exactly the sequential result.
+    import numpy as np
+    last_layer, layers = {}, []
+    for team1, team2 in games:
+        layer = 1 + max((last_layer.get(pid, -1) for pid in (*team1, *team2)), default=-1)
+        for pid in (*team1, *team2): last_layer[pid] = layer
+        layers.append(layer)
+    return np.array(layers, dtype=np.intp)
+
+
+def replay(games: List[Tuple[List[str], List[str], str]], k=K_FACTOR, start: Dict[str, float] = None) -> Dict[str, float]:
+    # games: (team1_pids, team2_pids, winner) oldest first, doubles only.
+    # Returns pid -> rating after every game, starting from `start` (default RATING_BASE).
+    import numpy as np
+    games = [(t1, t2, w) for t1, t2, w in games if len(t1) == 2 and len(t2) == 2]
+    if not games: return dict(start or {})
+    pids = sorted({pid for t1, t2, _ in games for pid in (*t1, *t2)} | set(start or {}))
+    pos = {pid: i for i, pid in enumerate(pids)}
+    ratings = np.full(len(pids), RATING_BASE)
+    for pid, value in (start or {}).items(): ratings[pos[pid]] = value
+
+    seats = np.array([[pos[p] for p in (*t1, *t2)] for t1, t2, _ in games], dtype=np.intp)  # (N, 4)
+    outcomes = np.array([outcome(w) for _, _, w in games])
+    layers = conflict_free_layers([(t1, t2) for t1, t2, _ in games])
+    order = np.argsort(layers, kind='stable')
+    bounds = np.flatnonzero(np.diff(layers[order])) + 1
+    for chunk in np.split(order, bounds):
+        layer_seats = seats[chunk]
+        delta = team1_deltas(ratings[layer_seats[:, :2]], ratings[layer_seats[:, 2:]], outcomes[chunk], k)
+        # No player appears twice in a layer, so plain fancy-index updates are safe
+        ratings[layer_seats[:, :2]] += delta[:, None]
+        ratings[layer_seats[:, 2:]] -= delta[:, None]
+    return dict(zip(pids, ratings.tolist()))
+
+
+def log_games(logs: Iterable[dict]):
+    # Game log entries (oldest first) -> replay() input
+    return [(log.get('team1_pids') or [], log.get('team2_pids') or [], log.get('Winner')) for log in logs]
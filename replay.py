@@ -0,0 +1,131 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# SESSION REPLAY
+# ────────────────────────────────────────────────────────────────────────────────
+# Feeds a recorded night's session events (see club.session_updates) back through the
+# real mutation code, as fast as it will go, against a fresh in-memory store. Each
+# event is timed and its store reads/writes counted per kind, so a real night doubles
+# as a benchmark. At the end the replayed queue is checked against a pure fold of the
+# same events (club.apply_event); any difference means the app logic and the event
+# log disagree.
+#
+#   python replay.py --archive archive                   # latest archived night
+#   python replay.py --archive archive --session Xy12ab --repeat 5
+#   python replay.py --db club.db --session-path clubs/acers/venues/main
+#
+# Players are stood in by their ids, so replayed log entries carry ids for names.
+
+import argparse
+import json
+import sys
+import time
+
+import archive
+import club
+import metrics
+import storage
+
+COMPARED_FIELDS = ('attendees', 'finishers_queue', 'main_queue')
+
+
+def archived_events(root, session_id=None):
+    manifest = archive.read_manifest(root)
+    if not manifest: raise SystemExit(f"No archived sessions in {root}")
+    entry = next((e for e in manifest if e['session_id'] == session_id), None) if session_id else manifest[-1]
+    if entry is None: raise SystemExit(f"Session {session_id} isn't in the archive")
+    table = archive.load(root, 'events', session_path=entry['session_path'])
+    events = [e for e in archive.stored_events(table) if e['session_id'] == entry['session_id']]
+    return entry['session_id'], events
+
+
+def stored_events(db_path, session_path):
+    refs = club.SessionRefs(storage.LocalStore.open(db_path), session_path)
+    session_id = refs.session.get().to_dict().get('session_id')
+    return session_id, [doc.to_dict() for doc in club.session_events(refs, session_id=session_id)]
+
+
+class Replay:
+    def __init__(self, events, registry):
+        self.events, self.registry = events, registry
+        self.refs = club.SessionRefs(storage.LocalStore())
+        self.start = club.start_session(self.refs)
+        pids = {pid for event in events for pid in event_pids(event)}
+        club.commit_in_batches(self.refs, (('set', self.refs.players.document(pid), club.new_player(pid)[1]) for pid in sorted(pids)))
+        self.index = club.load_player_index(self.refs)
+        # Like the app, so each write also pays for the public queue view and its wait estimates
+        self.refs.names = self.index.names_for
+        self.refs.courts = sorted({cid for event in events if event['kind'] == 'start' for cid in event['data']['games']})
+        self.stale = 0
+
+    def apply(self, event, state):
+        kind, data = event['kind'], event['data']
+        if kind == 'check_in': club.check_in_many(self.refs, state, data['pids'])
+        elif kind == 'check_out': club.check_out(self.refs, data['pids'], state)
+        elif kind == 'remove_from_queue': club.remove_from_queue(self.refs, data['pids'], state)
+        elif kind == 'start': club.start_games(self.refs, state, {cid: (g['team1'], g['team2']) for cid, g in data['games'].items()})
+        elif kind == 'finish': self.index.apply(club.finish_game(self.refs, self.index, state, data['court'], *data['score']))
+        else: club.commit_session_change(self.refs, state, lambda state, batch: (kind, data))
+
+    def run(self):
+        for event in self.events:
+            state = club.load_live_state(self.refs)  # The listener's copy in the app; not part of the timed op
+            with self.registry.operation(event['kind'], "replay"):
+                try:
+                    self.apply(event, state)
+                except club.StaleAction:
+                    self.stale += 1
+        return club.load_live_state(self.refs)
+
+    def compare(self, final):
+        # (fields whose players differ, fields in a different order) between the replay and
+        # a pure fold of the recorded events. Winners rejoin the queue by chooser count,
+        # which the stand-in roster doesn't have, so order alone can legitimately differ.
+        expected = dict(self.start)
+        for event in self.events: expected = club.apply_event(expected, event)
+        diverged, reordered = [], []
+        for field in COMPARED_FIELDS:
+            got, want = final.get(field, []), expected.get(field, [])
+            if sorted(got) != sorted(want): diverged.append(field)
+            elif got != want: reordered.append(field)
+        if sorted(final.get('active_games', {})) != sorted(expected.get('active_games', {})): diverged.append('active_games')
+        return diverged, reordered
+
+
+def event_pids(event):
+    data = event['data']
+    if event['kind'] == 'start': return [pid for g in data['games'].values() for pid in g['team1'] + g['team2']]
+    return data.get('pids', []) + data.get('finishers', [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded session through the app's mutation code.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--archive", help="Archive directory written on reset")
+    source.add_argument("--db", help="Local store file with a live session")
+    parser.add_argument("--session", help="Archived session id (default: the latest)")
+    parser.add_argument("--session-path", default="session/live_state")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the night this many times")
+    args = parser.parse_args(argv)
+
+    session_id, events = archived_events(args.archive, args.session) if args.archive else stored_events(args.db, args.session_path)
+    if not events: raise SystemExit("No events recorded for that session")
+    registry = metrics.Metrics()
+    storage.add_observer(registry.record_io)
+    started, diverged, reordered, stale = time.perf_counter(), set(), set(), 0
+    for _ in range(args.repeat):
+        replay = Replay(events, registry)
+        fields, order = replay.compare(replay.run())
+        diverged.update(fields); reordered.update(order); stale += replay.stale
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'session_id': session_id, 'events': len(events), 'repeat': args.repeat,
+        'wall_seconds': round(elapsed, 3), 'events_per_second': round(len(events) * args.repeat / elapsed, 1),
+        'stale_actions': stale, 'diverged_fields': sorted(diverged), 'reordered_fields': sorted(reordered),
+        'operations': [row for row in registry.snapshot()['operations'] if row['mode'] == "replay"],
+    }
+    print(json.dumps(result, indent=2))
+    return 1 if diverged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
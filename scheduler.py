@@ -0,0 +1,85 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# GLOBAL COURT SCHEDULER
+# ────────────────────────────────────────────────────────────────────────────────
+# Fills every free court in one pass instead of one chooser at a time. Players are
+# drawn from the head of finishers_queue + main_queue (winners first, as the queue is
+# already ordered), with a little slack so a court can be balanced by reaching a few
+# places further down. A greedy start is improved by local search over player swaps,
+# scored with the matchmaker's cost, until the time budget runs out.
+
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+import matchmaking
+
+TIME_BUDGET = 0.05    # Seconds of local search per plan
+SLACK_PER_COURT = 2   # How many extra queue places each court may reach past the strict head
+MOVES_PER_ROUND = 128
+STALL_ROUNDS = 8      # Stop early after this many rounds without an improving move
+
+
+class CourtPlan(NamedTuple):
+    cid: str
+    team1: List[str]
+    team2: List[str]
+    cost: float
+
+
+def plan(waiting, players_db, free_courts, recent_games=(), time_budget=TIME_BUDGET, seed=0,
+         weights=matchmaking.WEIGHTS) -> List[CourtPlan]:
+    n_courts = min(len(free_courts), len(waiting) // 4)
+    if not n_courts: return []
+    on_court = 4 * n_courts
+    pids = list(waiting[:on_court + SLACK_PER_COURT * n_courts])
+    strength = matchmaking.strengths(pids, players_db)
+    partners, opponents = matchmaking.history_matrices(pids, recent_games)
+    # Queue position cost: taking a player from further down delays everyone they skip
+    wait = weights['wait'] * np.arange(len(pids)) / max(len(pids) - 1, 1)
+
+    def court_costs(foursomes):
+        return matchmaking.split_scores(foursomes, strength, partners, opponents, weights).min(axis=1)
+
+    # Greedy start: the strict head of the queue, similar strengths grouped on a court.
+    # `order[:on_court]` holds the players on court (four per court), the rest are benched.
+    head = np.arange(on_court)
+    order = np.concatenate([head[np.argsort(-strength[head], kind='stable')], np.arange(on_court, len(pids))])
+    costs = court_costs(order[:on_court].reshape(n_courts, 4))
+
+    rng, stalls, moves = np.random.default_rng(seed), 0, np.arange(MOVES_PER_ROUND)
+    deadline = time.perf_counter() + time_budget
+    while stalls < STALL_ROUNDS and time.perf_counter() < deadline:
+        # A batch of candidate swaps: an on-court player with anyone on another court or the bench
+        first, second = rng.integers(0, on_court, MOVES_PER_ROUND), rng.integers(0, len(pids), MOVES_PER_ROUND)
+        court_a, court_b, swap = first // 4, second // 4, second < on_court
+        outgoing, incoming = order[first], order[second]
+        courts = order[:on_court].reshape(n_courts, 4)
+
+        new_a = courts[court_a]
+        new_a[moves, first % 4] = incoming
+        delta = court_costs(new_a) - costs[court_a]
+        if swap.any():
+            new_b = courts[court_b[swap]]
+            new_b[np.arange(swap.sum()), second[swap] % 4] = outgoing[swap]
+            delta[swap] += court_costs(new_b) - costs[court_b[swap]]
+        delta[~swap] += wait[incoming[~swap]] - wait[outgoing[~swap]]
+        delta[swap & (court_a == court_b)] = np.inf
+
+        best = int(np.argmin(delta))
+        if delta[best] >= -1e-9:
+            stalls += 1; continue
+        stalls = 0
+        order[[first[best], second[best]]] = order[[second[best], first[best]]]
+        for court in {int(court_a[best])} | ({int(court_b[best])} if swap[best] else set()):
+            costs[court] = court_costs(order[4 * court:4 * court + 4][None, :])[0]
+
+    # Earliest-queued players go to the lowest-numbered free court
+    foursomes = sorted(order[:on_court].reshape(n_courts, 4).tolist(), key=min)
+    plans = []
+    for cid, foursome in zip(sorted(free_courts, key=int), foursomes):
+        quad = np.array([sorted(foursome)])
+        split = int(matchmaking.split_scores(quad, strength, partners, opponents, weights).argmin(axis=1)[0])
+        a, b, c, d = quad[0][matchmaking.SPLITS[split]]
+        plans.append(CourtPlan(cid, [pids[a], pids[b]], [pids[c], pids[d]], round(float(court_costs(quad)[0]), 3)))
+    return plans
@@ -0,0 +1,416 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# STORAGE BACKENDS
+# ────────────────────────────────────────────────────────────────────────────────
+# The app only talks to a small, Firestore-shaped document store: documents and
+# collections addressed by slash paths, atomic array/increment transforms and
+# batched writes. `FirestoreStore` is the production backend; `LocalStore` keeps
+# everything in-process on SQLite for profiling, load tests and self-hosted clubs.
+
+import copy
+import datetime
+import pickle
+import random
+import sqlite3
+import string
+import threading
+from datetime import timezone
+from typing import Any, Callable, Dict, List
+
+
+# --- Field Transforms ---
+class ArrayUnion:
+    def __init__(self, values): self.values = list(values)
+
+class ArrayRemove:
+    def __init__(self, values): self.values = list(values)
+
+class Increment:
+    def __init__(self, value): self.value = value
+
+class _Sentinel:
+    def __init__(self, name): self.name = name
+    def __repr__(self): return self.name
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+ASCENDING, DESCENDING = "ASCENDING", "DESCENDING"
+
+
+class NotFound(Exception):
+    pass
+
+
+# Raised when a write carrying `last_update_time` finds the document has moved on
+class Conflict(Exception):
+    pass
+
+
+def new_doc_id():
+    return "".join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+# --- I/O Observers ---
+# Both backends report every billed document read and write as observer(kind, count),
+# kind being "read" or "write", on the thread that caused it (see metrics.py).
+_observers: List[Callable[[str, int], None]] = []
+
+def add_observer(observer):
+    if observer not in _observers: _observers.append(observer)
+
+def _observe(kind, count):
+    for observer in _observers: observer(kind, count)
+
+
+class Store:
+    def collection(self, path): raise NotImplementedError
+    def document(self, path): raise NotImplementedError
+    def batch(self): raise NotImplementedError
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# FIRESTORE
+# ────────────────────────────────────────────────────────────────────────────────
+class FirestoreStore(Store):
+    def __init__(self, client):
+        from firebase_admin import firestore
+        self._fs = firestore
+        self.client = client
+
+    def collection(self, path): return _FsQuery(self, self.client.collection(path))
+    def document(self, path): return _FsDocument(self, self.client.document(path))
+    def batch(self): return _FsBatch(self, self.client.batch())
+
+    def _option(self, last_update_time):
+        return self.client.write_option(last_update_time=last_update_time) if last_update_time else None
+
+    def _encode(self, value):
+        if isinstance(value, ArrayUnion): return self._fs.ArrayUnion(value.values)
+        if isinstance(value, ArrayRemove): return self._fs.ArrayRemove(value.values)
+        if isinstance(value, Increment): return self._fs.Increment(value.value)
+        if value is DELETE_FIELD: return self._fs.DELETE_FIELD
+        if value is SERVER_TIMESTAMP: return self._fs.SERVER_TIMESTAMP
+        if isinstance(value, dict): return {k: self._encode(v) for k, v in value.items()}
+        return value
+
+
+class _FsSnapshot:
+    def __init__(self, store, raw):
+        self._raw = raw
+        self.id, self.exists, self.update_time = raw.id, raw.exists, raw.update_time
+        self.reference = _FsDocument(store, raw.reference)
+
+    def to_dict(self): return self._raw.to_dict()
+
+
+class _FsDocument:
+    def __init__(self, store, raw):
+        self._store, self.raw = store, raw
+        self.id, self.path = raw.id, raw.path
+
+    def get(self):
+        _observe("read", 1)
+        return _FsSnapshot(self._store, self.raw.get())
+    def set(self, data, merge=False):
+        _observe("write", 1)
+        return self.raw.set(self._store._encode(data), merge=merge)
+    def update(self, data, last_update_time=None):
+        from google.api_core.exceptions import FailedPrecondition
+        _observe("write", 1)
+        try: return self.raw.update(self._store._encode(data), option=self._store._option(last_update_time))
+        except FailedPrecondition as e: raise Conflict(self.path) from e
+    def delete(self):
+        _observe("write", 1)
+        return self.raw.delete()
+    def collection(self, name): return _FsQuery(self._store, self.raw.collection(name))
+
+    def on_snapshot(self, callback):
+        def deliver(docs, changes, read_time):
+            _observe("read", max(1, len(changes or docs)))
+            callback([_FsSnapshot(self._store, d) for d in docs], changes, read_time)
+        return self.raw.on_snapshot(deliver)
+
+
+class _FsQuery:
+    def __init__(self, store, raw):
+        self._store, self.raw = store, raw
+
+    # Collection-only operations
+    def document(self, doc_id=None): return _FsDocument(self._store, self.raw.document(doc_id) if doc_id else self.raw.document())
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return ref
+
+    def where(self, field, op, value): return _FsQuery(self._store, self.raw.where(filter=self._store._fs.FieldFilter(field, op, value)))
+    def order_by(self, field, direction=ASCENDING): return _FsQuery(self._store, self.raw.order_by(field, direction=direction))
+    def limit(self, count): return _FsQuery(self._store, self.raw.limit(count))
+    def start_after(self, cursor): return _FsQuery(self._store, self.raw.start_after(cursor._raw if isinstance(cursor, _FsSnapshot) else cursor))
+    def stream(self):
+        count = 0
+        try:
+            for raw in self.raw.stream():
+                count += 1
+                yield _FsSnapshot(self._store, raw)
+        finally:
+            _observe("read", max(1, count))  # An empty query still bills one read
+
+
+class _FsBatch:
+    def __init__(self, store, raw):
+        self._store, self.raw, self._count = store, raw, 0
+
+    def set(self, ref, data, merge=False):
+        self._count += 1; self.raw.set(ref.raw, self._store._encode(data), merge=merge)
+    def update(self, ref, data, last_update_time=None):
+        self._count += 1; self.raw.update(ref.raw, self._store._encode(data), option=self._store._option(last_update_time))
+    def delete(self, ref):
+        self._count += 1; self.raw.delete(ref.raw)
+    def commit(self):
+        from google.api_core.exceptions import FailedPrecondition
+        _observe("write", self._count)
+        try: return self.raw.commit()
+        except FailedPrecondition as e: raise Conflict("batch") from e
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# LOCAL (SQLITE)
+# ────────────────────────────────────────────────────────────────────────────────
+_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b, 'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+_MISSING = object()
+
+
+def _get_field(data, field):
+    for part in field.split('.'):
+        if not isinstance(data, dict) or part not in data: return _MISSING
+        data = data[part]
+    return data
+
+
+def _resolve(value, current, now, merge):
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(v for v in value.values if v not in result)
+        return result
+    if isinstance(value, ArrayRemove):
+        return [v for v in current if v not in value.values] if isinstance(current, list) else []
+    if isinstance(value, Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if value is SERVER_TIMESTAMP: return now
+    if isinstance(value, dict):
+        result = dict(current) if merge and isinstance(current, dict) else {}
+        for k, v in value.items():
+            if v is DELETE_FIELD: result.pop(k, None)
+            else: result[k] = _resolve(v, result.get(k), now, merge)
+        return result
+    return copy.deepcopy(value)
+
+
+def _apply_update(data, updates, now):
+    data = copy.deepcopy(data)
+    for field_path, value in updates.items():
+        *parents, leaf = field_path.split('.')
+        node = data
+        for part in parents:
+            if not isinstance(node.get(part), dict): node[part] = {}
+            node = node[part]
+        if value is DELETE_FIELD: node.pop(leaf, None)
+        else: node[leaf] = _resolve(value, node.get(leaf), now, merge=False)
+    return data
+
+
+def apply_update(data, updates, now=None):
+    # The document an update() would leave behind, for callers deriving views from a write
+    return _apply_update(data, updates, now or datetime.datetime.now(timezone.utc))
+
+
+class LocalStore(Store):
+    _instances: Dict[str, "LocalStore"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path=":memory:"):
+        # One store per path per process, so every session (and the benchmark harness)
+        # shares the same data and snapshot listeners
+        with cls._instances_lock:
+            if path not in cls._instances: cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def __init__(self, path=":memory:"):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (path TEXT PRIMARY KEY, parent TEXT NOT NULL, data BLOB NOT NULL, update_time TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_parent ON docs(parent)")
+        self._listeners: Dict[str, List[Callable]] = {}
+        self._last_time = datetime.datetime.now(timezone.utc)
+        # Billing-equivalent counters: documents returned (min 1 per query), listener
+        # deliveries and documents written
+        self.reads = self.writes = 0
+
+    def collection(self, path): return LocalQuery(self, path.strip('/'))
+    def document(self, path): return LocalDocument(self, path.strip('/'))
+    def batch(self): return LocalBatch(self)
+
+    # --- Internals ---
+    def _now(self):
+        # Strictly increasing, so update_time can double as a write precondition
+        now = max(datetime.datetime.now(timezone.utc), self._last_time + datetime.timedelta(microseconds=1))
+        self._last_time = now
+        return now
+
+    def _read(self, path):
+        row = self._conn.execute("SELECT data, update_time FROM docs WHERE path = ?", (path,)).fetchone()
+        if row is None: return None, None
+        return pickle.loads(row[0]), datetime.datetime.fromisoformat(row[1])
+
+    def _snapshot(self, path):
+        data, update_time = self._read(path)
+        return LocalSnapshot(LocalDocument(self, path), data, update_time)
+
+    def _scan(self, parent):
+        rows = self._conn.execute("SELECT path, data, update_time FROM docs WHERE parent = ?", (parent,)).fetchall()
+        return [LocalSnapshot(LocalDocument(self, path), pickle.loads(data), datetime.datetime.fromisoformat(ts)) for path, data, ts in rows]
+
+    def _commit(self, writes):
+        with self._lock:
+            now = self._now()
+            touched = []
+            self._conn.execute("BEGIN")
+            try:
+                for kind, path, payload, merge, last_update_time in writes:
+                    current, update_time = self._read(path)
+                    if last_update_time is not None and update_time != last_update_time: raise Conflict(path)
+                    if kind == 'delete':
+                        self._conn.execute("DELETE FROM docs WHERE path = ?", (path,))
+                    else:
+                        if kind == 'update':
+                            if current is None: raise NotFound(path)
+                            data = _apply_update(current, payload, now)
+                        else:
+                            data = _resolve(payload, current, now, merge)
+                        self._conn.execute("INSERT OR REPLACE INTO docs (path, parent, data, update_time) VALUES (?, ?, ?, ?)",
+                                           (path, path.rsplit('/', 1)[0], pickle.dumps(data), now.isoformat()))
+                    touched.append(path)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            callbacks = [(path, cb) for path in dict.fromkeys(touched) for cb in self._listeners.get(path, [])]
+            self.writes += len(writes)
+            self.reads += len(callbacks)
+        _observe("write", len(writes))
+        for path, cb in callbacks:
+            _observe("read", 1)
+            cb([self._snapshot(path)], None, now)
+        return now
+
+    def _listen(self, path, callback):
+        with self._lock:
+            self._listeners.setdefault(path, []).append(callback)
+            snapshot = self._snapshot(path)
+            self.reads += 1
+        _observe("read", 1)
+        callback([snapshot] if snapshot.exists else [], None, self._last_time)
+        return LocalWatch(self, path, callback)
+
+
+class LocalWatch:
+    def __init__(self, store, path, callback):
+        self._store, self._path, self._callback = store, path, callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        with self._store._lock:
+            self._store._listeners.get(self._path, []).remove(self._callback)
+        self.is_active = False
+
+
+class LocalSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference, self._data, self.update_time = reference, data, update_time
+        self.id, self.exists = reference.id, data is not None
+
+    def to_dict(self): return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class LocalDocument:
+    def __init__(self, store, path):
+        self._store, self.path = store, path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def get(self):
+        with self._store._lock:
+            self._store.reads += 1
+            snapshot = self._store._snapshot(self.path)
+        _observe("read", 1)
+        return snapshot
+    def set(self, data, merge=False): return self._store._commit([('set', self.path, data, merge, None)])
+    def update(self, data, last_update_time=None): return self._store._commit([('update', self.path, data, False, last_update_time)])
+    def delete(self): return self._store._commit([('delete', self.path, None, False, None)])
+    def collection(self, name): return LocalQuery(self._store, f"{self.path}/{name}")
+    def on_snapshot(self, callback): return self._store._listen(self.path, callback)
+
+
+class LocalQuery:
+    def __init__(self, store, path, filters=(), orders=(), count=None, cursor=None):
+        self._store, self.path = store, path
+        self._filters, self._orders, self._count, self._cursor = filters, orders, count, cursor
+
+    def _with(self, **changes):
+        args = dict(filters=self._filters, orders=self._orders, count=self._count, cursor=self._cursor)
+        return LocalQuery(self._store, self.path, **{**args, **changes})
+
+    # Collection-only operations
+    def document(self, doc_id=None): return LocalDocument(self._store, f"{self.path}/{doc_id or new_doc_id()}")
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return ref
+
+    def where(self, field, op, value): return self._with(filters=self._filters + ((field, _OPS[op], value),))
+    def order_by(self, field, direction=ASCENDING): return self._with(orders=self._orders + ((field, direction),))
+    def limit(self, count): return self._with(count=count)
+    def start_after(self, cursor): return self._with(cursor=cursor)
+
+    def _key(self, data):
+        return [_get_field(data, field) for field, _ in self._orders]
+
+    def _after_cursor(self, key, cursor_key):
+        for (field, direction), a, b in zip(self._orders, key, cursor_key):
+            if a == b: continue
+            return a < b if direction == DESCENDING else a > b
+        return False
+
+    def stream(self):
+        with self._store._lock: docs = self._store._scan(self.path)
+        docs = [d for d in docs if all(
+            (v := _get_field(d._data, field)) is not _MISSING and op(v, value) for field, op, value in self._filters)]
+        # Like Firestore, ordering on a field drops documents that don't have it
+        docs = [d for d in docs if _MISSING not in self._key(d._data)]
+        docs.sort(key=lambda d: d.id)
+        for field, direction in reversed(self._orders):
+            docs.sort(key=lambda d: _get_field(d._data, field), reverse=direction == DESCENDING)
+        if self._cursor is not None:
+            cursor_data = self._cursor._data if isinstance(self._cursor, LocalSnapshot) else self._cursor
+            cursor_key = self._key(cursor_data)
+            docs = [d for d in docs if self._after_cursor(self._key(d._data), cursor_key)]
+        if self._count is not None: docs = docs[:self._count]
+        with self._store._lock: self._store.reads += max(1, len(docs))
+        _observe("read", max(1, len(docs)))
+        yield from docs
+
+
+class LocalBatch:
+    def __init__(self, store):
+        self._store, self._writes = store, []
+
+    def set(self, ref, data, merge=False): self._writes.append(('set', ref.path, data, merge, None))
+    def update(self, ref, data, last_update_time=None): self._writes.append(('update', ref.path, data, False, last_update_time))
+    def delete(self, ref): self._writes.append(('delete', ref.path, None, False, None))
+    def commit(self): return self._store._commit(self._writes)
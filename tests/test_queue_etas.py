@@ -0,0 +1,32 @@
+import datetime
+from datetime import timezone, timedelta
+
+import club
+
+NOW = datetime.datetime(2026, 10, 17, 19, 0, tzinfo=timezone.utc)
+
+
+def test_idle_low_court_waits_for_busy_high_court():
+    # Court 1 free, court 2 busy, fewer than four waiting: used to spin forever. The four
+    # coming off court 2 rejoin ahead of a and b, so they never get a court in the horizon.
+    state = {'main_queue': ['a', 'b'], 'finishers_queue': [],
+             'active_games': {'2': {'player_ids': ['c', 'd', 'e', 'f'], 'start_time': NOW - timedelta(minutes=5)}}}
+    assert club.queue_etas(state, ['1', '2'], NOW) == [None, None]
+
+
+def test_idle_court_fills_once_enough_players_come_off():
+    state = {'main_queue': ['a', 'b', 'g', 'h'], 'finishers_queue': [],
+             'active_games': {'2': {'player_ids': ['c', 'd', 'e', 'f'], 'start_time': NOW}}}
+    assert club.queue_etas(state, ['1', '2'], NOW) == [NOW] * 4
+
+
+def test_nobody_on_court_and_too_few_waiting():
+    assert club.queue_etas({'main_queue': ['a', 'b'], 'finishers_queue': [], 'active_games': {}}, ['1', '2'], NOW) == [None, None]
+
+
+def test_finishers_go_ahead_of_main_queue():
+    state = {'finishers_queue': ['f1', 'f2', 'f3', 'f4'], 'main_queue': ['m1', 'm2', 'm3', 'm4'],
+             'active_games': {'1': {'player_ids': ['a', 'b', 'c', 'd'], 'start_time': NOW}}}
+    etas = club.queue_etas(state, ['1', '2'], NOW)
+    assert etas[:4] == [NOW] * 4
+    assert all(eta is None or eta > NOW for eta in etas[4:])
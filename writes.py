@@ -0,0 +1,111 @@
+# ────────────────────────────────────────────────────────────────────────────────
+# BACKGROUND WRITE QUEUE
+# ────────────────────────────────────────────────────────────────────────────────
+# Operator taps hand their mutation to a per-session-document worker and return at
+# once. Until the write lands (and the snapshot listener has delivered it), the job's
+# idempotent preview is applied to every state copy the app reads, so the tap shows up
+# immediately. One worker per document keeps mutations in tap order; consecutive jobs
+# with the same coalescing key (e.g. a burst of check-ins) go out as a single write.
+# Transient errors are retried with backoff; StaleAction and exhausted retries are
+# reported back to the session that queued the job.
+
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+import club
+
+MAX_ATTEMPTS = 4
+BACKOFF_SECONDS = 0.5
+
+
+class Job:
+    def __init__(self, label, run, items, preview, key=None, owner=None, on_success=None):
+        # run(state, items) performs the write; preview(state, items) mirrors it on a copy
+        self.label, self.run, self.items, self.preview = label, run, list(items), preview
+        self.key, self.owners, self.on_success = key, {owner}, on_success
+        self.status = 'queued'  # queued -> running -> done | failed
+        self.error, self.settled_version = None, None
+
+
+class WriteQueue:
+    def __init__(self, listener_state, listener_version, load_state):
+        # listener_state() -> the snapshot listener's copy (or None), listener_version() ->
+        # its version, load_state() -> a fresh read for when the listener is behind us
+        self._listener_state, self._version_provider, self._load_state = listener_state, listener_version, load_state
+        self._last_settled = -1
+        self._changed = threading.Condition()
+        self._queue = deque()
+        self._tracked = []  # Jobs whose preview still applies
+        self._failures = defaultdict(list)  # owner -> failed jobs not yet shown
+        self._worker = None
+
+    def submit(self, label, run, items, preview, key=None, owner=None, on_success=None):
+        with self._changed:
+            last = self._queue[-1] if self._queue else None
+            if key is not None and last is not None and last.key == key and last.status == 'queued':
+                last.items.extend(i for i in items if i not in last.items)
+                last.owners.add(owner)
+                return last
+            job = Job(label, run, items, preview, key, owner, on_success)
+            self._queue.append(job); self._tracked.append(job)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="write-queue", daemon=True)
+                self._worker.start()
+            self._changed.notify_all()
+            return job
+
+    def overlay(self, state):
+        # Applies the previews of writes that aren't visible in `state` yet
+        version = self._version_provider()
+        with self._changed:
+            self._tracked = [j for j in self._tracked if j.status in ('queued', 'running')
+                             or (j.status == 'done' and version <= j.settled_version)]
+            pending = [(j.preview, list(j.items)) for j in self._tracked]
+        for preview, items in pending: preview(state, items)
+        return state
+
+    def pending(self):
+        with self._changed: return len(self._queue)
+
+    def take_failures(self, owner):
+        with self._changed: return self._failures.pop(owner, [])
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._queue)
+                job = self._queue[0]
+                job.status = 'running'
+            self._execute(job)
+            with self._changed:
+                self._queue.popleft()
+                self._changed.notify_all()
+
+    def _confirmed_state(self):
+        # Until the listener has delivered our previous write, its copy would make the
+        # next job validate against stale state (e.g. finish a court it hasn't seen start)
+        state = self._listener_state() if self._version_provider() > self._last_settled else None
+        return state if state is not None else self._load_state()
+
+    def _execute(self, job):
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                result = job.run(self._confirmed_state(), list(job.items))
+            except club.StaleAction as e:
+                return self._fail(job, str(e))
+            except Exception as e:  # Network blips, deadline exceeded, ...
+                if attempt == MAX_ATTEMPTS - 1: return self._fail(job, f"Couldn't save ({e}). Please try again.")
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            if job.on_success: job.on_success(result)
+            with self._changed:
+                job.status, job.settled_version = 'done', self._version_provider()
+                self._last_settled = job.settled_version
+            return
+
+    def _fail(self, job, message):
+        with self._changed:
+            job.status, job.error = 'failed', message
+            for owner in job.owners: self._failures[owner].append(job)